@@ -1,110 +1,309 @@
-from langchain_community.llms import Ollama
-from langchain.agents import initialize_agent, Tool, AgentType
-from langchain.memory import ConversationBufferMemory
-from langchain_core.tools import BaseTool
-from typing import List, Dict, Any
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-from tavily import TavilyClient
-import os
-
-class FeedbackTools:
-    name: str = "feedback_tools"
-    description: str = "Feedback tools for each lesson type"
-
-    def comp_question_feedback(self, question: str, context: str, correct_answer: str, student_response: str) -> str:
-        feedback = f"The student was asked the given the following question and context:\
-                Question: {question}\
-                Context: {context}\
-                Student Response: {student_response}\
-                Correct Answer: {correct_answer}\
-                If the student's response is incorrect, give constructive feedback on the response and ask them to try again\
-                If the student's response is correct, congratulate them and proceed to the next exercise."
-        print(f"Feedback: {feedback}")
-        return feedback
-    
-    def mcq_question_feedback(self, question: str, context: str, correct_answer: str, student_response: str) -> str:
-        feedback = f"The student was asked the given the following question and context:\
-                Question: {question}\
-                Context: {context}\
-                Student Response: {student_response}\
-                Correct Answer: {correct_answer}\
-                If the student's response is incorrect, give constructive feedback on the response and ask them to try again\
-                If the student's response is correct, congratulate them and proceed to the next exercise."
-        print(f"Feedback: {feedback}")
-        return feedback
-    
-    def fill_blank_question_feedback(self, question: str, context: str, correct_answer: str, student_response: str) -> str:
-        feedback = f"The student was asked the given the following question and context:\
-                Question: {question}\
-                Context: {context}\
-                Student Response: {student_response}\
-                Correct Answer: {correct_answer}\
-                If the student's response is incorrect, give constructive feedback on the response and ask them to try again\
-                If the student's response is correct, congratulate them and proceed to the next exercise."
-        print(f"Feedback: {feedback}")
-        return feedback
-    
-    def pronunciation_feedback(self, sentence: str, pronunciation: str, student_response: str) -> str:
-        feedback = f"The student was asked to pronounce the sentence: {sentence}\
-                Student Response: {student_response}\
-                If the student's pronunciation is incorrect, give constructive feedback on the response and ask them to try again\
-                If the student's pronunciation is correct, congratulate them and proceed to the next exercise."
-        print(f"Feedback: {feedback}")
-        return feedback
-    
-    feedback_tools = [
-        Tool(
-            name="comp_question_feedback",
-            description="Feedback for a comprehension question",
-            function=comp_question_feedback
-        ),
-        Tool(
-            name="mcq_question_feedback",
-            description="Feedback for a multiple choice question",
-            function=mcq_question_feedback
-        ),
-        Tool(
-            name="fill_blank_question_feedback",
-            description="Feedback for a fill in the blank question",
-            function=fill_blank_question_feedback
-        ),
-        Tool(
-            name="pronunciation_feedback",
-            description="Feedback for pronunciation exercise",
-            function=pronunciation_feedback
-        )
-    ]
-
-    
-class FeedbackAgent:
-    def __init__(self, model: str):
-        self.model = OllamaLLM(model)
-        self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        self.prompt = ChatPromptTemplate.from_template("""Question: {question}""")
-        self.tools = FeedbackTools.feedback_tools
-        self.chain = self.prompt | self.model
-
-        self.agent = initialize_agent(
-            tools=self.tools,
-            model=self.model,
-            agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
-            memory=self.memory
-        )
-    
-    def invoke(self, query: str) -> str:
-        return self.chain.run(input=query)
-    
-
-class TutorTools:
-        class WebSearchTool(BaseTool):
-            name: str = "web_search"
-            description: str = "Search tool for finding information from the internet"
-
-            def _run(self, query: str) -> str:
-                tavily_client = TavilyClient(api_key=os.environ.get("TAVILY_API_KEY"))
-                response = tavily_client.extract(query)
-                return response
-            
-            def _arun(self, query: str) -> str:
-                raise NotImplementedError("Async not implemented")
+from langchain_core.tools import BaseTool, StructuredTool
+from typing import TYPE_CHECKING, AsyncIterator, List, Dict, Any, Optional
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_ollama.llms import OllamaLLM
+from functools import cached_property
+from Grading_Utils import CORRECT, INCORRECT, GradeResult, grade_fill_blank, grade_mcq, templated_feedback
+from Model_Registry import lazy_import, registry
+from Stream_Utils import astrip_reasoning
+from Tracing_Utils import trace_step
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+# The agents framework, memory, SQLAlchemy/NumPy (cache) and tavily are
+# imported on first use so importing this module stays cheap
+if TYPE_CHECKING:
+    from Feedback_Cache import FeedbackCache
+
+logger = logging.getLogger(__name__)
+
+# One shared cap on in-flight requests to the local Ollama server. Every
+# BoundedOllamaLLM instance, sync or async, on any thread or event loop,
+# draws from the same slots, so the limit holds across models and sessions.
+# Async callers that find no free slot wait for one on a small thread pool
+# rather than blocking the event loop.
+_ollama_slots = threading.BoundedSemaphore(8)
+_slot_waiters = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ollama-slot")
+
+
+def set_ollama_concurrency(limit: int) -> None:
+    # Process-wide; call once at start-up. Calls already holding a slot
+    # release it to the semaphore they took it from.
+    global _ollama_slots
+    if limit < 1:
+        raise ValueError("Ollama concurrency limit must be at least 1")
+    _ollama_slots = threading.BoundedSemaphore(limit)
+
+
+@asynccontextmanager
+async def _async_slot() -> AsyncIterator[None]:
+    slots = _ollama_slots
+    if not slots.acquire(blocking=False):
+        waiter = asyncio.get_running_loop().run_in_executor(_slot_waiters, slots.acquire)
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The waiting thread still gets the slot; hand it straight back
+            waiter.add_done_callback(lambda _: slots.release())
+            raise
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+class BoundedOllamaLLM(OllamaLLM):
+    """OllamaLLM that waits for a free slot before calling the server."""
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        with _ollama_slots:
+            return super()._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, prompts, stop=None, run_manager=None, **kwargs):
+        async with _async_slot():
+            return await super()._agenerate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, prompt, stop=None, run_manager=None, **kwargs):
+        async with _async_slot():
+            async for chunk in super()._astream(prompt, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+
+
+class FeedbackTools:
+    name: str = "feedback_tools"
+    description: str = "Feedback tools for each lesson type"
+
+    def __init__(self, explain_incorrect: bool = False, model: Optional[Any] = None, cache: Optional["FeedbackCache"] = None):
+        # MCQ and fill in the blank answers are graded locally first. Answers
+        # the grader is sure about get a templated verdict without an LLM call;
+        # set explain_incorrect to still send certain-wrong answers to the LLM
+        # for constructive feedback.
+        self.explain_incorrect = explain_incorrect
+        # Without a model the tools return the feedback prompt for the calling
+        # agent to answer. With one (an LLM or a Model_Router.CascadeRouter)
+        # they generate the feedback themselves, and repeat answers are served
+        # from the cache.
+        self.model = model
+        self.cache = cache
+        # Model calls made so far, and the local grade of the last MCQ/fill in
+        # the blank answer (None for exercise types only the model can grade)
+        self.llm_calls = 0
+        self.last_grade: Optional[GradeResult] = None
+        self._calls_lock = threading.Lock()
+        self.feedback_tools = [
+            StructuredTool.from_function(
+                func=self.comp_question_feedback,
+                name="comp_question_feedback",
+                description="Feedback for a comprehension question"
+            ),
+            StructuredTool.from_function(
+                func=self.mcq_question_feedback,
+                name="mcq_question_feedback",
+                description="Feedback for a multiple choice question"
+            ),
+            StructuredTool.from_function(
+                func=self.fill_blank_question_feedback,
+                name="fill_blank_question_feedback",
+                description="Feedback for a fill in the blank question"
+            ),
+            StructuredTool.from_function(
+                func=self.pronunciation_feedback,
+                name="pronunciation_feedback",
+                description="Feedback for pronunciation exercise"
+            )
+        ]
+
+    def copy(self) -> "FeedbackTools":
+        # Same model and cache, own last_grade: one per thread grading in parallel
+        return FeedbackTools(explain_incorrect=self.explain_incorrect, model=self.model, cache=self.cache)
+
+    def _is_final(self, result: GradeResult) -> bool:
+        return result.verdict == CORRECT or (result.verdict == INCORRECT and not self.explain_incorrect)
+
+    def _cached(self, question: str, context: str, correct_answer: str, student_response: str,
+                verdict: Optional[str] = None) -> Optional[str]:
+        # verdict: the local grade of this answer, passed along rather than
+        # read back from last_grade, which another thread may have replaced
+        if self.model is None or self.cache is None:
+            return None
+        feedback = self.cache.get(question, context, correct_answer, student_response, verdict=verdict)
+        if feedback is not None:
+            logger.debug("Feedback (cached): %s", feedback)
+        return feedback
+
+    def _respond(self, kind: str, prompt: str, question: str, context: str, correct_answer: str, student_response: str,
+                 verdict: Optional[str] = None) -> str:
+        if self.model is None:
+            logger.debug("Feedback: %s", prompt)
+            return prompt
+        with trace_step(f"{kind}_feedback"):
+            if hasattr(self.model, "route"):
+                # A CascadeRouter picks the model per exercise kind and confidence
+                feedback = self.model.route(prompt, kind=kind)
+            else:
+                feedback = self.model.invoke(prompt)
+        with self._calls_lock:
+            self.llm_calls += 1
+        if self.cache is not None:
+            self.cache.put(question, context, correct_answer, student_response, feedback, verdict=verdict)
+        logger.debug("Feedback: %s", feedback)
+        return feedback
+
+    @staticmethod
+    def _verdict_hint(result: GradeResult) -> str:
+        if result.verdict == INCORRECT:
+            return "The student's response has already been graded as incorrect. "
+        return ""
+
+    def comp_question_feedback(self, question: str, context: str, correct_answer: str, student_response: str) -> str:
+        self.last_grade = None
+        cached = self._cached(question, context, correct_answer, student_response)
+        if cached is not None:
+            return cached
+        feedback = f"The student was asked the given the following question and context:\
+                Question: {question}\
+                Context: {context}\
+                Student Response: {student_response}\
+                Correct Answer: {correct_answer}\
+                If the student's response is incorrect, give constructive feedback on the response and ask them to try again\
+                If the student's response is correct, congratulate them and proceed to the next exercise."
+        return self._respond("comprehension", feedback, question, context, correct_answer, student_response)
+    
+    def mcq_question_feedback(self, question: str, context: str, correct_answer: str, student_response: str) -> str:
+        result = self.last_grade = grade_mcq(question, context, correct_answer, student_response)
+        if self._is_final(result):
+            feedback = templated_feedback(result)
+            logger.debug("Feedback: %s", feedback)
+            return feedback
+        cached = self._cached(question, context, correct_answer, student_response, result.verdict)
+        if cached is not None:
+            return cached
+        feedback = f"{self._verdict_hint(result)}The student was asked the given the following question and context:\
+                Question: {question}\
+                Context: {context}\
+                Student Response: {student_response}\
+                Correct Answer: {correct_answer}\
+                If the student's response is incorrect, give constructive feedback on the response and ask them to try again\
+                If the student's response is correct, congratulate them and proceed to the next exercise."
+        return self._respond("mcq", feedback, question, context, correct_answer, student_response, result.verdict)
+    
+    def fill_blank_question_feedback(self, question: str, context: str, correct_answer: str, student_response: str) -> str:
+        result = self.last_grade = grade_fill_blank(question, context, correct_answer, student_response)
+        if self._is_final(result):
+            feedback = templated_feedback(result)
+            logger.debug("Feedback: %s", feedback)
+            return feedback
+        cached = self._cached(question, context, correct_answer, student_response, result.verdict)
+        if cached is not None:
+            return cached
+        feedback = f"{self._verdict_hint(result)}The student was asked the given the following question and context:\
+                Question: {question}\
+                Context: {context}\
+                Student Response: {student_response}\
+                Correct Answer: {correct_answer}\
+                If the student's response is incorrect, give constructive feedback on the response and ask them to try again\
+                If the student's response is correct, congratulate them and proceed to the next exercise."
+        return self._respond("fill_blank", feedback, question, context, correct_answer, student_response, result.verdict)
+    
+    def pronunciation_feedback(self, sentence: str, pronunciation: str, student_response: str) -> str:
+        self.last_grade = None
+        cached = self._cached(sentence, pronunciation, "", student_response)
+        if cached is not None:
+            return cached
+        feedback = f"The student was asked to pronounce the sentence: {sentence}\
+                Student Response: {student_response}\
+                If the student's pronunciation is incorrect, give constructive feedback on the response and ask them to try again\
+                If the student's pronunciation is correct, congratulate them and proceed to the next exercise."
+        return self._respond("pronunciation", feedback, sentence, pronunciation, "", student_response)
+    
+
+class FeedbackAgent:
+    def __init__(self, model: str, cache: Optional["FeedbackCache"] = None, router: Optional[Any] = None):
+        # The model, memory and agent are built on first use. With a router,
+        # invoke/ainvoke try the small model first and escalate when unsure.
+        self.model_name = model
+        self.cache = cache
+        self.router = router
+        self.prompt = ChatPromptTemplate.from_template("""Question: {question}""")
+        self.tools = FeedbackTools().feedback_tools
+
+    @cached_property
+    def model(self) -> "BoundedOllamaLLM":
+        return registry.get_or_register(f"ollama:{self.model_name}", lambda: BoundedOllamaLLM(model=self.model_name))
+
+    @cached_property
+    def memory(self):
+        TokenBudgetMemory = lazy_import("Memory_Utils").TokenBudgetMemory
+        return TokenBudgetMemory(llm=self.model, memory_key="chat_history", return_messages=True)
+
+    @cached_property
+    def chain(self):
+        return self.prompt | self.model
+
+    @cached_property
+    def agent(self):
+        agents = lazy_import("langchain.agents")
+        return agents.initialize_agent(
+            tools=self.tools,
+            llm=self.model,
+            agent=agents.AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
+            memory=self.memory
+        )
+    
+    def invoke(self, query: str) -> str:
+        cached = self.cache.get(query, "", "", "") if self.cache is not None else None
+        if cached is not None:
+            return cached
+        if self.router is not None:
+            response = self.router.route(self.prompt.format(question=query))
+        else:
+            response = self.chain.invoke({"question": query})
+        if self.cache is not None:
+            self.cache.put(query, "", "", "", response)
+        return response
+
+    async def ainvoke(self, query: str) -> str:
+        # The cache does blocking SQLite I/O, so it runs off the event loop
+        cached = await asyncio.to_thread(self.cache.get, query, "", "", "") if self.cache is not None else None
+        if cached is not None:
+            return cached
+        if self.router is not None:
+            response = await self.router.aroute(self.prompt.format(question=query))
+        else:
+            response = await self.chain.ainvoke({"question": query})
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, query, "", "", "", response)
+        return response
+
+    async def astream(self, query: str) -> AsyncIterator[str]:
+        # Yield visible tokens as they arrive, dropping any <think> block
+        cached = await asyncio.to_thread(self.cache.get, query, "", "", "") if self.cache is not None else None
+        if cached is not None:
+            yield cached
+            return
+        tokens = []
+        async for token in astrip_reasoning(self.chain.astream({"question": query})):
+            tokens.append(token)
+            yield token
+        if self.cache is not None:
+            await asyncio.to_thread(self.cache.put, query, "", "", "", "".join(tokens))
+    
+
+class TutorTools:
+        class WebSearchTool(BaseTool):
+            name: str = "web_search"
+            description: str = "Search tool for finding information from the internet"
+
+            def _run(self, query: str) -> str:
+                tavily = lazy_import("tavily")
+                tavily_client = tavily.TavilyClient(api_key=os.environ.get("TAVILY_API_KEY"))
+                response = tavily_client.extract(query)
+                return response
+            
+            async def _arun(self, query: str) -> str:
+                # The Tavily client is blocking; keep it off the event loop.
+                return await asyncio.to_thread(self._run, query)
@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import httpx
+import ollama
+
+from Agent_Utils import FeedbackTools, set_ollama_concurrency
+from Grading_Utils import normalise_answer
+from Model_Registry import lazy_import, registry
+
+KINDS = ("comprehension", "mcq", "fill_blank", "pronunciation")
+# Ollama being unreachable, or refusing every request (say, a model that has
+# not been pulled), is not the record's fault: stop the run instead of
+# checkpointing an error row, so rerunning regrades from there
+ABORT_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError, ollama.ResponseError)
+
+
+def _record_key(record: Dict[str, Any]) -> str:
+    parts = [record.get("kind", "")] + [normalise_answer(str(record.get(field, "")))
+                                         for field in ("question", "context", "correct_answer", "student_response")]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def grade_record(feedback_tools: FeedbackTools, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Grade one submission record and return its feedback and local verdict.
+
+    Records carry ``kind`` (one of KINDS), ``question``, ``context``,
+    ``correct_answer`` and ``student_response``; for pronunciation the
+    question is the sentence and the correct answer its pronunciation.
+    The verdict is the one ``feedback_tools`` graded with, so each thread
+    needs its own FeedbackTools (see ``FeedbackTools.copy``).
+    """
+    kind = record.get("kind")
+    question, context = record.get("question", ""), record.get("context", "")
+    correct_answer, response = record.get("correct_answer", ""), record.get("student_response", "")
+    if kind == "comprehension":
+        feedback = feedback_tools.comp_question_feedback(question, context, correct_answer, response)
+    elif kind == "mcq":
+        feedback = feedback_tools.mcq_question_feedback(question, context, correct_answer, response)
+    elif kind == "fill_blank":
+        feedback = feedback_tools.fill_blank_question_feedback(question, context, correct_answer, response)
+    elif kind == "pronunciation":
+        feedback = feedback_tools.pronunciation_feedback(question, correct_answer, response)
+    else:
+        raise ValueError(f"Unknown exercise kind {kind!r}, expected one of {', '.join(KINDS)}")
+    grade = feedback_tools.last_grade
+    return {"feedback": feedback, "verdict": grade.verdict if grade is not None else None}
+
+
+class BatchGrader:
+    """Grades a JSONL file of submissions without loading it into memory.
+
+    Records are read one line at a time and graded on ``concurrency``
+    worker threads, each with its own FeedbackTools; in-flight Ollama calls
+    stay under the process-wide cap (``set_ollama_concurrency``). Identical answers (after
+    normalisation) are graded once: later copies wait on the first one's
+    result. Results are written to the output JSONL in input order, and a
+    checkpoint of the input/output offsets is saved every
+    ``checkpoint_every`` records, so an interrupted run resumes where the
+    last checkpoint left off. Records that cannot be graded get an
+    ``error`` row; if Ollama cannot be reached or rejects the request the
+    run stops with the results so far checkpointed.
+    """
+
+    def __init__(self, feedback_tools: Optional[FeedbackTools] = None, concurrency: int = 8,
+                 checkpoint_every: int = 100, max_dedup_entries: int = 100000):
+        self.feedback_tools = feedback_tools
+        self.concurrency = concurrency
+        self.checkpoint_every = checkpoint_every
+        self.max_dedup_entries = max_dedup_entries
+        self.stats = {"records": 0, "graded": 0, "deduplicated": 0, "errors": 0, "resumed_from": 0}
+        self._results: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+        self._local = threading.local()
+
+    def _tools(self) -> FeedbackTools:
+        if self.feedback_tools is None:
+            lazy_import("app")  # registers the models and the feedback router
+            self.feedback_tools = FeedbackTools(model=registry.get("feedback_router"))
+        return self.feedback_tools
+
+    def _grade_in_thread(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        # FeedbackTools keeps the last grade on the instance, so workers don't share one
+        tools = getattr(self._local, "tools", None)
+        if tools is None:
+            tools = self._local.tools = self._tools().copy()
+        return grade_record(tools, record)
+
+    @staticmethod
+    def _load_checkpoint(path: str) -> Optional[Dict[str, int]]:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _save_checkpoint(path: str, checkpoint: Dict[str, int]) -> None:
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, path)
+
+    async def _grade(self, executor: ThreadPoolExecutor, line: int, raw: bytes) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"line": line}
+        try:
+            record = json.loads(raw)
+            result["id"] = record.get("id")
+            key = _record_key(record)
+            shared = self._results.get(key)
+            if shared is not None:
+                self._results.move_to_end(key)
+                self.stats["deduplicated"] += 1
+                result.update(await asyncio.shield(shared), deduplicated=True)
+                return result
+            shared = self._results[key] = asyncio.get_running_loop().create_future()
+            while len(self._results) > self.max_dedup_entries:
+                self._results.popitem(last=False)
+            try:
+                graded = await asyncio.get_running_loop().run_in_executor(executor, self._grade_in_thread, record)
+            except Exception as error:
+                shared.set_exception(error)
+                shared.exception()  # waiters re-raise it; don't warn when there are none
+                self._results.pop(key, None)
+                raise
+            shared.set_result(graded)
+            self.stats["graded"] += 1
+            result.update(graded, deduplicated=False)
+        except ABORT_ERRORS:
+            raise
+        except Exception as error:
+            self.stats["errors"] += 1
+            result["error"] = f"{type(error).__name__}: {error}"
+        return result
+
+    async def grade_file(self, input_path: str, output_path: str, checkpoint_path: Optional[str] = None) -> Dict[str, int]:
+        checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        checkpoint = self._load_checkpoint(checkpoint_path)
+        if checkpoint is None:
+            # A fresh run appends after whatever the output already holds;
+            # checkpoint that now so a crash before the first checkpoint
+            # never truncates it
+            size = os.path.getsize(output_path) if os.path.exists(output_path) else 0
+            checkpoint = {"line": 0, "input_offset": 0, "output_offset": size}
+            self._save_checkpoint(checkpoint_path, checkpoint)
+        self.stats["resumed_from"] = checkpoint["line"]
+        self._tools()
+        window = self.concurrency * 4
+        pending: Deque[Tuple[int, asyncio.Task]] = deque()
+        line, input_offset = checkpoint["line"], checkpoint["input_offset"]
+        since_checkpoint = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-grader") as executor, \
+                open(input_path, "rb") as source, open(output_path, "ab") as sink:
+            # Drop anything written after the last checkpoint; it is regraded
+            sink.truncate(checkpoint["output_offset"])
+            sink.seek(checkpoint["output_offset"])
+            source.seek(input_offset)
+
+            def save() -> None:
+                nonlocal since_checkpoint
+                sink.flush()
+                os.fsync(sink.fileno())
+                checkpoint["output_offset"] = sink.tell()
+                self._save_checkpoint(checkpoint_path, checkpoint)
+                since_checkpoint = 0
+
+            async def write_oldest() -> None:
+                nonlocal since_checkpoint
+                end_offset, task = pending[0]
+                result = await task
+                pending.popleft()
+                sink.write(json.dumps(result).encode("utf-8") + b"\n")
+                checkpoint["line"] += 1
+                checkpoint["input_offset"] = end_offset
+                since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_every:
+                    save()
+
+            try:
+                for raw in iter(source.readline, b""):
+                    input_offset += len(raw)
+                    if not raw.strip():
+                        # Blank lines are skipped but still advance the checkpoint
+                        if not pending:
+                            checkpoint["input_offset"] = input_offset
+                        continue
+                    line += 1
+                    self.stats["records"] += 1
+                    pending.append((input_offset, asyncio.ensure_future(self._grade(executor, line, raw))))
+                    if len(pending) >= window:
+                        await write_oldest()
+                while pending:
+                    await write_oldest()
+            finally:
+                # On failure keep everything written in order; the rest is regraded on resume
+                for _, task in pending:
+                    task.cancel()
+                save()
+        return self.stats
+
+
+async def grade_file(input_path: str, output_path: str, concurrency: int = 8, checkpoint_path: Optional[str] = None,
+                     feedback_tools: Optional[FeedbackTools] = None) -> Dict[str, int]:
+    return await BatchGrader(feedback_tools, concurrency).grade_file(input_path, output_path, checkpoint_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Grade a JSONL file of student submissions")
+    parser.add_argument("input", help="JSONL file of {id, kind, question, context, correct_answer, student_response}")
+    parser.add_argument("output", help="JSONL file to append results to; rerun with the same output to resume")
+    parser.add_argument("--concurrency", type=int, default=8, help="Ollama requests in flight")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="records between checkpoints")
+    parser.add_argument("--cache", help="SQLite feedback cache to reuse across runs")
+    args = parser.parse_args()
+
+    lazy_import("app")
+    cache = lazy_import("Feedback_Cache").FeedbackCache(args.cache) if args.cache else None
+    tools = FeedbackTools(model=registry.get("feedback_router"), cache=cache)
+    grader = BatchGrader(tools, args.concurrency, args.checkpoint_every)
+    # The process-wide Ollama cap; set here, not in grade_file, so library
+    # callers keep the limit their sessions were started with
+    set_ollama_concurrency(args.concurrency)
+    stats = asyncio.run(grader.grade_file(args.input, args.output, args.checkpoint))
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import json
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from Model_Registry import lazy_import, registry
+from Tracing_Utils import Trace, aggregate, histogram, trace
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+SCENARIOS = ("feedback_agent", "feedback_tools", "tutoring_turn")
+
+# One submission per FeedbackTools method. The MCQ and fill in the blank
+# answers are deliberately ambiguous so they reach the model.
+FEEDBACK_RECORDS = [
+    {"kind": "comprehension", "question": "Identify the subject in 'The cat sat on the mat.'", "context": "",
+     "correct_answer": "The cat", "student_response": "the cat is the subject"},
+    {"kind": "mcq", "question": "Which word is a verb?\nA) cat\nB) sat\nC) mat", "context": "",
+     "correct_answer": "B", "student_response": "I think it is the second one"},
+    {"kind": "fill_blank", "question": "She ___ to school every day.", "context": "",
+     "correct_answer": "goes|walks", "student_response": "go's"},
+    {"kind": "pronunciation", "question": "The weather is lovely today.", "context": "",
+     "correct_answer": "ðə ˈwɛðər ɪz ˈlʌvli təˈdeɪ", "student_response": "the wether is lovly today"},
+]
+
+
+def count_tokens(text: str) -> int:
+    return len(_TOKEN.findall(text))
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for every benchmark client to connect at once
+    request_queue_size = 256
+
+
+class StubOllamaServer:
+    """A local stand-in for the Ollama HTTP API, for benchmarks.
+
+    Serves ``/api/generate`` (streamed NDJSON, as the real server does) and
+    ``/api/tags``. Each reply waits ``first_token_latency`` seconds, then
+    streams ``completion_tokens`` tokens at ``tokens_per_second``; the final
+    chunk reports prompt and completion token counts like Ollama does.
+    Replies follow the prompt: ReAct agent prompts call the english_tutor
+    tool once and then answer, confidence requests get a confidence line and
+    models whose name contains ``think_models`` open with a <think> block.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, first_token_latency: float = 0.05,
+                 tokens_per_second: float = 200.0, completion_tokens: int = 30, confidence: int = 90,
+                 think_models: str = "r1"):
+        self.first_token_latency = first_token_latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.confidence = confidence
+        self.think_models = think_models
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = _StubHTTPServer((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubOllamaServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def _filler(self, count: int) -> str:
+        words = "Good effort so far , keep practising the structure of each sentence and try again .".split()
+        return " ".join(words[i % len(words)] for i in range(max(count, 1)))
+
+    def reply(self, model: str, prompt: str) -> str:
+        if "Do I need to use a tool?" in prompt:
+            scratchpad = prompt.rsplit("New input:", 1)[-1]
+            if "Observation:" not in scratchpad:
+                text = f"Thought: Do I need to use a tool? Yes\nAction: english_tutor\nAction Input: {self._filler(8)}"
+            else:
+                text = f"Thought: Do I need to use a tool? No\nAI: {self._filler(self.completion_tokens)}"
+        else:
+            text = self._filler(self.completion_tokens)
+        if "Confidence: N" in prompt:
+            text += f"\nConfidence: {self.confidence}"
+        if self.think_models and self.think_models in model:
+            text = f"<think>{self._filler(self.completion_tokens // 2)}</think>\n{text}"
+        return text
+
+    def _handler(self) -> type:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def _json(self, body: Dict[str, Any]) -> None:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                if self.path == "/api/tags":
+                    self._json({"models": []})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self) -> None:
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with stub._lock:
+                    stub.requests += 1
+                model, prompt = request.get("model", ""), request.get("prompt", "")
+                if not prompt:
+                    # A warm-up request only loads the model
+                    self._json({"model": model, "created_at": _now(), "response": "", "done": True,
+                                "done_reason": "load"})
+                    return
+                pieces = re.findall(r"\s*\S+", stub.reply(model, prompt))
+                start = time.perf_counter()
+                stream = request.get("stream", True)
+                if stream:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                time.sleep(stub.first_token_latency)
+                for i, piece in enumerate(pieces):
+                    if i:
+                        time.sleep(1 / stub.tokens_per_second)
+                    if stream:
+                        chunk = {"model": model, "created_at": _now(), "response": piece, "done": False}
+                        self.wfile.write(json.dumps(chunk).encode("utf-8") + b"\n")
+                        self.wfile.flush()
+                elapsed = int((time.perf_counter() - start) * 1e9)
+                done = {"model": model, "created_at": _now(), "response": "" if stream else "".join(pieces),
+                        "done": True, "done_reason": "stop", "total_duration": elapsed, "load_duration": 0,
+                        "prompt_eval_count": count_tokens(prompt), "prompt_eval_duration": 0,
+                        "eval_count": len(pieces), "eval_duration": elapsed}
+                if not stream:
+                    self._json(done)
+                    return
+                self.wfile.write(json.dumps(done).encode("utf-8") + b"\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def use_stub_models(base_url: str) -> None:
+    # Point every model app registers at the stub server
+    lazy_import("app")
+    BoundedOllamaLLM = lazy_import("Agent_Utils").BoundedOllamaLLM
+    registry.register("supervisor_model",
+                      lambda: BoundedOllamaLLM(model="deepseek-r1:8b", tags=["supervisor"], base_url=base_url))
+    registry.register("tutor_model", lambda: BoundedOllamaLLM(model="llama3.2:3b", base_url=base_url))
+    registry.register("ollama:llama3.2:3b", lambda: BoundedOllamaLLM(model="llama3.2:3b", base_url=base_url))
+    registry.register("feedback_router", lambda: lazy_import("Model_Router").CascadeRouter(
+        small=registry.get("tutor_model"), large=registry.get("supervisor_model")
+    ))
+
+
+async def _run_level(make_call: Callable[[int], Awaitable[Trace]], concurrency: int, requests: int) -> Dict[str, Any]:
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> Trace:
+        async with slots:
+            return await make_call(i)
+
+    start = time.perf_counter()
+    traces = await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - start
+    report = aggregate(list(traces))
+    report["concurrency"] = concurrency
+    report["throughput_per_second"] = requests / wall if wall else None
+    report["wall_seconds"] = [t.summary()["wall_seconds"] for t in traces]
+    return report
+
+
+async def run_scenario(name: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    Agent_Utils = lazy_import("Agent_Utils")
+    Agent_Utils.set_ollama_concurrency(concurrency)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"bench-{name}")
+    loop = asyncio.get_running_loop()
+
+    def in_thread(label: str, call: Callable[[], Any]) -> Awaitable[Trace]:
+        # Context variables don't follow run_in_executor, so trace in the worker
+        def traced() -> Trace:
+            with trace(label) as current:
+                call()
+            return current
+        return loop.run_in_executor(executor, traced)
+
+    if name == "feedback_agent":
+        agent = Agent_Utils.FeedbackAgent("llama3.2:3b")
+
+        def make_call(i: int) -> Awaitable[Trace]:
+            return in_thread(name, lambda: agent.invoke(f"What is the past tense of 'go'? ({i})"))
+    elif name == "feedback_tools":
+        grade_record = lazy_import("Batch_Grader").grade_record
+        tools = Agent_Utils.FeedbackTools(model=registry.get("feedback_router"))
+        local = threading.local()
+
+        def grade(record: Dict[str, Any]) -> Dict[str, Any]:
+            # One FeedbackTools per worker thread, as Batch_Grader does
+            if not hasattr(local, "tools"):
+                local.tools = tools.copy()
+            return grade_record(local.tools, record)
+
+        def make_call(i: int) -> Awaitable[Trace]:
+            record = FEEDBACK_RECORDS[i % len(FEEDBACK_RECORDS)]
+            return in_thread(record["kind"], lambda: grade(record))
+    elif name == "tutoring_turn":
+        manager = lazy_import("Session_Manager").SessionManager()
+
+        async def make_call(i: int) -> Trace:
+            with trace(name) as current:
+                await manager.run_tutoring_session(f"bench-{i}", "Can you help me with phrasal verbs?")
+            return current
+    else:
+        raise ValueError(f"Unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+    try:
+        return await _run_level(make_call, concurrency, requests)
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def run_benchmarks(scenarios: List[str], levels: List[int], requests_per_level: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for name in scenarios:
+        results[name] = {}
+        for level in levels:
+            results[name][str(level)] = await run_scenario(name, level, max(requests_per_level, level))
+    return results
+
+
+def check_regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Compare hop counts and prompt sizes with a baseline run.
+
+    Latency depends on the machine, so only the model-independent numbers
+    (LLM hops and prompt tokens per traced call) fail the check.
+    """
+    failures = []
+    for name, levels in baseline.get("results", {}).items():
+        for level, expected in levels.items():
+            actual = results.get(name, {}).get(level)
+            if actual is None:
+                continue
+            for key in ("llm_hops_per_trace", "prompt_tokens_per_trace"):
+                if actual[key] > expected[key] * (1 + tolerance):
+                    failures.append(f"{name} @ {level}: {key} {actual[key]:.1f} > baseline {expected[key]:.1f}")
+    return failures
+
+
+def render_histograms(results: Dict[str, Any]) -> str:
+    sections = []
+    for name, levels in results.items():
+        for level, report in levels.items():
+            sections.append(
+                f"{name} @ concurrency {level}: {report['throughput_per_second']:.1f} req/s, "
+                f"p50 {report['wall_p50_seconds']:.3f}s, p95 {report['wall_p95_seconds']:.3f}s, "
+                f"{report['llm_hops_per_trace']:.1f} LLM hops, {report['prompt_tokens_per_trace']:.0f} prompt tokens, "
+                f"TTFT p50 {report['ttft_p50_seconds'] or 0:.3f}s\n{histogram(report['wall_seconds'])}"
+            )
+    return "\n\n".join(sections)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the tutor against a local stub Ollama server")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16, 64], help="levels to run")
+    parser.add_argument("--requests", type=int, default=16, help="requests per level (at least the level)")
+    parser.add_argument("--first-token-latency", type=float, default=0.05, help="stub seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="stub generation speed")
+    parser.add_argument("--completion-tokens", type=int, default=30, help="stub reply length")
+    parser.add_argument("--format", choices=("json", "histogram"), default="json")
+    parser.add_argument("--output", help="also write the JSON results here")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative increase over the baseline")
+    args = parser.parse_args()
+
+    with StubOllamaServer(first_token_latency=args.first_token_latency, tokens_per_second=args.tokens_per_second,
+                          completion_tokens=args.completion_tokens) as server:
+        use_stub_models(server.base_url)
+        results = asyncio.run(run_benchmarks(args.scenarios, args.concurrency, args.requests))
+    report = {"config": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2) if args.format == "json" else render_histograms(results))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = check_regressions(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION: {failure}", file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import threading
+from typing import Dict, FrozenSet, List, Optional
+
+from sqlalchemy import ForeignKey, Integer, String, Text, create_engine, select, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from Lesson_Orchestrator import Exercise, Lesson, content_words, rank_snippets
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class LessonRow(Base):
+    __tablename__ = "lessons"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    title: Mapped[str] = mapped_column(String(200), index=True)
+    introduction: Mapped[str] = mapped_column(Text)
+
+
+class ExerciseRow(Base):
+    __tablename__ = "exercises"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    lesson_id: Mapped[int] = mapped_column(ForeignKey("lessons.id"), index=True)
+    position: Mapped[int] = mapped_column(Integer)
+    kind: Mapped[str] = mapped_column(String(32))
+    question: Mapped[str] = mapped_column(Text)
+    context: Mapped[str] = mapped_column(Text, default="")
+    correct_answer: Mapped[str] = mapped_column(Text, default="")
+
+
+class SnippetRow(Base):
+    __tablename__ = "snippets"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    lesson_id: Mapped[int] = mapped_column(ForeignKey("lessons.id"), index=True)
+    text: Mapped[str] = mapped_column(Text)
+
+
+class CurriculumStore:
+    """SQLite store for lessons, exercises, answer keys and explanation notes.
+
+    Snippets are indexed with FTS5 so each turn can pull in just the few
+    notes most relevant to the student's input. Lessons and exercises are
+    cached in-process once read, so repeat lookups never touch the database.
+    """
+
+    def __init__(self, path: str = "curriculum.db"):
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS snippets_fts USING fts5(text, content='snippets', content_rowid='id')"
+            ))
+        self._lock = threading.Lock()
+        self._lessons: Dict[int, Lesson] = {}
+        self._exercises: Dict[int, Exercise] = {}
+        # lesson id -> content words of each of its snippets, for search_snippets
+        self._snippet_words: Dict[int, List[FrozenSet[str]]] = {}
+
+    def add_lesson(self, lesson: Lesson) -> int:
+        with self._lock, Session(self.engine) as session:
+            row = LessonRow(title=lesson.title, introduction=lesson.introduction)
+            session.add(row)
+            session.flush()
+            for position, exercise in enumerate(lesson.exercises):
+                session.add(ExerciseRow(
+                    lesson_id=row.id, position=position, kind=exercise.kind, question=exercise.question,
+                    context=exercise.context, correct_answer=exercise.correct_answer
+                ))
+            snippets = [SnippetRow(lesson_id=row.id, text=snippet) for snippet in lesson.snippets]
+            session.add_all(snippets)
+            session.flush()
+            for snippet in snippets:
+                session.execute(text("INSERT INTO snippets_fts(rowid, text) VALUES (:id, :text)"),
+                                {"id": snippet.id, "text": snippet.text})
+            session.commit()
+            return row.id
+
+    def update_exercise(self, exercise_id: int, question: Optional[str] = None, context: Optional[str] = None,
+                        correct_answer: Optional[str] = None) -> None:
+        with self._lock, Session(self.engine) as session:
+            row = session.get(ExerciseRow, exercise_id)
+            if row is None:
+                raise KeyError(f"No exercise with id {exercise_id}")
+            for name, value in (("question", question), ("context", context), ("correct_answer", correct_answer)):
+                if value is not None:
+                    setattr(row, name, value)
+            session.commit()
+            self._lessons.pop(row.lesson_id, None)
+            self._exercises.pop(exercise_id, None)
+
+    def get_lesson(self, lesson_id: int) -> Lesson:
+        lesson = self._lessons.get(lesson_id)
+        if lesson is not None:
+            return lesson
+        with Session(self.engine) as session:
+            row = session.get(LessonRow, lesson_id)
+            if row is None:
+                raise KeyError(f"No lesson with id {lesson_id}")
+            exercises = session.scalars(
+                select(ExerciseRow).where(ExerciseRow.lesson_id == lesson_id).order_by(ExerciseRow.position)
+            ).all()
+            snippets = session.scalars(select(SnippetRow.text).where(SnippetRow.lesson_id == lesson_id)).all()
+            lesson = Lesson(
+                title=row.title, introduction=row.introduction, lesson_id=row.id, snippets=list(snippets),
+                exercises=[self._to_exercise(exercise) for exercise in exercises]
+            )
+        with self._lock:
+            self._lessons[lesson_id] = lesson
+            self._snippet_words[lesson_id] = [content_words(snippet) for snippet in lesson.snippets]
+            for exercise in lesson.exercises:
+                self._exercises[exercise.exercise_id] = exercise
+        return lesson
+
+    def get_exercise(self, exercise_id: int) -> Exercise:
+        exercise = self._exercises.get(exercise_id)
+        if exercise is not None:
+            return exercise
+        with Session(self.engine) as session:
+            row = session.get(ExerciseRow, exercise_id)
+            if row is None:
+                raise KeyError(f"No exercise with id {exercise_id}")
+            exercise = self._to_exercise(row)
+        with self._lock:
+            self._exercises[exercise_id] = exercise
+        return exercise
+
+    @staticmethod
+    def _to_exercise(row: ExerciseRow) -> Exercise:
+        return Exercise(kind=row.kind, question=row.question, correct_answer=row.correct_answer,
+                        context=row.context, exercise_id=row.id)
+
+    def list_lessons(self) -> List[Dict[str, object]]:
+        with Session(self.engine) as session:
+            return [{"lesson_id": row.id, "title": row.title} for row in session.scalars(select(LessonRow).order_by(LessonRow.id))]
+
+    def search_snippets(self, query: str, lesson_id: Optional[int] = None, k: int = 3) -> List[str]:
+        if lesson_id is not None:
+            # The lesson's notes are already in memory; ranking them there
+            # costs the same however large the curriculum grows
+            lesson = self.get_lesson(lesson_id)
+            return rank_snippets(query, lesson.snippets, k, self._snippet_words.get(lesson_id))
+        # Across the whole curriculum: any of the query's content words may
+        # match, and FTS5 ranks by BM25
+        words = sorted(content_words(query))
+        if not words:
+            return []
+        sql = ("SELECT snippets.text FROM snippets_fts JOIN snippets ON snippets.id = snippets_fts.rowid "
+               "WHERE snippets_fts MATCH :match ORDER BY bm25(snippets_fts) LIMIT :k")
+        with self.engine.connect() as connection:
+            return list(connection.execute(text(sql), {"match": " OR ".join(f'"{word}"' for word in words), "k": k}).scalars())
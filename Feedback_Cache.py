@@ -0,0 +1,262 @@
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Float, Integer, LargeBinary, String, Text, create_engine, delete, func, inspect, select, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+from Grading_Utils import CORRECT, INCORRECT, normalise_answer
+
+Embedder = Callable[[str], List[float]]
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class FeedbackCacheEntry(Base):
+    __tablename__ = "feedback_cache"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    key: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    exercise_key: Mapped[str] = mapped_column(String(64), index=True)
+    exercise_fingerprint: Mapped[str] = mapped_column(String(64))
+    response: Mapped[str] = mapped_column(Text)
+    feedback: Mapped[str] = mapped_column(Text)
+    embedding: Mapped[bytes] = mapped_column(LargeBinary)
+    # Local grade of the response, if any; semantic hits must agree with it
+    verdict: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    created_at: Mapped[float] = mapped_column(Float)
+    last_used_at: Mapped[float] = mapped_column(Float, index=True)
+    hits: Mapped[int] = mapped_column(Integer, default=0)
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def hashed_ngram_embedding(text: str, dim: int = 512, n: int = 3) -> np.ndarray:
+    # Cheap local embedding: hashed character n-grams, L2 normalised. It
+    # cannot tell word order apart ("the cat sat" ~ "sat the cat"), so it is
+    # only used if passed explicitly as a FeedbackCache embedder.
+    vector = np.zeros(dim, dtype=np.float32)
+    padded = f" {text} "
+    for i in range(max(len(padded) - n + 1, 1)):
+        gram = padded[i:i + n].encode("utf-8")
+        vector[int.from_bytes(hashlib.blake2b(gram, digest_size=4).digest(), "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class FeedbackCache:
+    """Two-tier SQLite cache for generated feedback.
+
+    The exact tier is keyed on the normalised (exercise, correct answer,
+    response) tuple. The semantic tier is off unless an ``embedder`` is
+    given. It compares the response embedding against cached responses for
+    the same exercise and returns the closest one above
+    ``similarity_threshold``, but only for responses the local grader has
+    already marked correct or incorrect and only from entries with the same
+    verdict, so a near-identical wrong answer never gets praise meant for a
+    right one. Short responses, where a single character can flip the
+    verdict, only use the exact tier. Entries expire after ``ttl`` seconds
+    and the least recently used ones are evicted beyond ``max_entries``.
+    Cached feedback for an exercise is dropped when feedback is stored for
+    a changed question, context or correct answer; lookups never drop it.
+    """
+
+    def __init__(self, path: str = "feedback_cache.db", max_entries: int = 100000, ttl: Optional[float] = 30 * 24 * 3600,
+                 similarity_threshold: float = 0.92, min_semantic_length: int = 24, embedder: Optional[Embedder] = None):
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(self.engine)
+        if "verdict" not in {column["name"] for column in inspect(self.engine).get_columns("feedback_cache")}:
+            # Caches created before verdicts were stored
+            with self.engine.begin() as connection:
+                connection.execute(text("ALTER TABLE feedback_cache ADD COLUMN verdict VARCHAR(16)"))
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.min_semantic_length = min_semantic_length
+        self.embedder = embedder
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+        self._lock = threading.Lock()
+        # exercise_key -> (entry ids, embedding matrix, verdicts), loaded lazily
+        # and kept up to date as entries are added and removed
+        self._vectors: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._fingerprints: Dict[str, str] = {}
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embedder(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _keys(question: str, context: str, correct_answer: str, student_response: str,
+              exercise_id: Optional[str]) -> Tuple[str, str, str, str]:
+        question, context = normalise_answer(question), normalise_answer(context)
+        correct_answer, response = normalise_answer(correct_answer), normalise_answer(student_response)
+        exercise_key = _digest(exercise_id) if exercise_id else _digest(question, context)
+        fingerprint = _digest(question, context, correct_answer)
+        return exercise_key, fingerprint, _digest(fingerprint, response), response
+
+    def _known_fingerprint(self, session: Session, exercise_key: str) -> Optional[str]:
+        known = self._fingerprints.get(exercise_key)
+        if known is None:
+            known = session.scalar(
+                select(FeedbackCacheEntry.exercise_fingerprint).where(FeedbackCacheEntry.exercise_key == exercise_key).limit(1)
+            )
+            if known is not None:
+                self._fingerprints[exercise_key] = known
+        return known
+
+    def _check_fingerprint(self, session: Session, exercise_key: str, fingerprint: str) -> None:
+        # Only called when storing: a lookup with another answer key must not
+        # wipe the exercise's entries
+        known = self._known_fingerprint(session, exercise_key)
+        if known is not None and known != fingerprint:
+            self._invalidate(session, exercise_key)
+        self._fingerprints[exercise_key] = fingerprint
+
+    def _invalidate(self, session: Session, exercise_key: str) -> None:
+        session.execute(delete(FeedbackCacheEntry).where(FeedbackCacheEntry.exercise_key == exercise_key))
+        self._vectors.pop(exercise_key, None)
+        self._fingerprints.pop(exercise_key, None)
+        self.stats["invalidations"] += 1
+
+    def _index(self, session: Session, exercise_key: str, dim: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        index = self._vectors.get(exercise_key)
+        if index is None:
+            rows = session.execute(
+                select(FeedbackCacheEntry.id, FeedbackCacheEntry.embedding, FeedbackCacheEntry.verdict)
+                .where(FeedbackCacheEntry.exercise_key == exercise_key)
+            ).all()
+            # Entries stored without an embedder (or with another one) have no usable vector
+            rows = [row for row in rows if len(row.embedding) == dim * 4]
+            ids = np.array([row.id for row in rows], dtype=np.int64)
+            vectors = (np.stack([np.frombuffer(row.embedding, dtype=np.float32) for row in rows]) if rows
+                       else np.empty((0, dim), np.float32))
+            verdicts = np.array([row.verdict or "" for row in rows], dtype=object)
+            index = self._vectors[exercise_key] = (ids, vectors, verdicts)
+        return index
+
+    def _add_to_index(self, exercise_key: str, entry: FeedbackCacheEntry) -> None:
+        index = self._vectors.get(exercise_key)
+        if index is None:
+            return  # loaded, with this entry, on the next semantic lookup
+        ids, vectors, verdicts = index
+        position = np.flatnonzero(ids == entry.id)
+        if len(position):
+            verdicts[position[0]] = entry.verdict or ""
+        elif len(entry.embedding) == vectors.shape[1] * 4:
+            self._vectors[exercise_key] = (
+                np.append(ids, entry.id), np.vstack([vectors, np.frombuffer(entry.embedding, dtype=np.float32)]),
+                np.append(verdicts, entry.verdict or "")
+            )
+
+    def _drop_from_index(self, entry_ids: List[int]) -> None:
+        if not entry_ids or not self._vectors:
+            return
+        for exercise_key, (ids, vectors, verdicts) in list(self._vectors.items()):
+            keep = ~np.isin(ids, entry_ids)
+            if not keep.all():
+                self._vectors[exercise_key] = (ids[keep], vectors[keep], verdicts[keep])
+
+    def _expired(self, entry: FeedbackCacheEntry, now: float) -> bool:
+        return self.ttl is not None and now - entry.created_at > self.ttl
+
+    def get(self, question: str, context: str, correct_answer: str, student_response: str,
+            exercise_id: Optional[str] = None, verdict: Optional[str] = None) -> Optional[str]:
+        # verdict: the local grader's verdict for this response, if it has one
+        exercise_key, fingerprint, key, response = self._keys(question, context, correct_answer, student_response, exercise_id)
+        now = time.time()
+        with self._lock, Session(self.engine) as session:
+            entry = session.scalar(select(FeedbackCacheEntry).where(FeedbackCacheEntry.key == key))
+            kind = "exact_hits"
+            # The exact key includes the answer key; similar entries are only
+            # trusted when they were stored under this answer key
+            if (entry is None and self.embedder is not None and verdict in (CORRECT, INCORRECT)
+                    and len(response) >= self.min_semantic_length
+                    and self._known_fingerprint(session, exercise_key) == fingerprint):
+                query = self._embed(response)
+                ids, vectors, verdicts = self._index(session, exercise_key, len(query))
+                same_verdict = verdicts == verdict
+                if same_verdict.any():
+                    scores = np.where(same_verdict, vectors @ query, -np.inf)
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity_threshold:
+                        entry = session.get(FeedbackCacheEntry, int(ids[best]))
+                        kind = "semantic_hits"
+            if entry is None or self._expired(entry, now):
+                if entry is not None:
+                    self._drop_from_index([entry.id])
+                    session.delete(entry)
+                self.stats["misses"] += 1
+                session.commit()
+                return None
+            entry.last_used_at = now
+            entry.hits += 1
+            feedback = entry.feedback
+            session.commit()
+            self.stats[kind] += 1
+            return feedback
+
+    def put(self, question: str, context: str, correct_answer: str, student_response: str, feedback: str,
+            exercise_id: Optional[str] = None, verdict: Optional[str] = None) -> None:
+        exercise_key, fingerprint, key, response = self._keys(question, context, correct_answer, student_response, exercise_id)
+        now = time.time()
+        with self._lock, Session(self.engine) as session:
+            self._check_fingerprint(session, exercise_key, fingerprint)
+            entry = session.scalar(select(FeedbackCacheEntry).where(FeedbackCacheEntry.key == key))
+            if entry is None:
+                embedding = self._embed(response).tobytes() if self.embedder is not None else b""
+                entry = FeedbackCacheEntry(
+                    key=key, exercise_key=exercise_key, exercise_fingerprint=fingerprint, response=response,
+                    embedding=embedding, created_at=now, hits=0
+                )
+                session.add(entry)
+            entry.feedback = feedback
+            entry.verdict = verdict
+            entry.created_at = entry.last_used_at = now
+            session.flush()
+            self._add_to_index(exercise_key, entry)
+            self.stats["stores"] += 1
+            self._evict(session)
+            session.commit()
+
+    def _evict(self, session: Session) -> None:
+        evicted: List[int] = []
+        if self.ttl is not None:
+            evicted += session.scalars(
+                select(FeedbackCacheEntry.id).where(FeedbackCacheEntry.created_at < time.time() - self.ttl)
+            ).all()
+        overflow = session.scalar(select(func.count(FeedbackCacheEntry.id))) - len(evicted) - self.max_entries
+        if overflow > 0:
+            evicted += session.scalars(
+                select(FeedbackCacheEntry.id).where(FeedbackCacheEntry.id.not_in(evicted))
+                .order_by(FeedbackCacheEntry.last_used_at).limit(overflow)
+            ).all()
+        if evicted:
+            session.execute(delete(FeedbackCacheEntry).where(FeedbackCacheEntry.id.in_(evicted)))
+            self.stats["evictions"] += len(evicted)
+            self._drop_from_index(evicted)
+
+    def invalidate_exercise(self, question: str = "", context: str = "", exercise_id: Optional[str] = None) -> None:
+        exercise_key = self._keys(question, context, "", "", exercise_id)[0]
+        with self._lock, Session(self.engine) as session:
+            self._invalidate(session, exercise_key)
+            session.commit()
+
+    def clear(self) -> None:
+        with self._lock, Session(self.engine) as session:
+            session.execute(delete(FeedbackCacheEntry))
+            session.commit()
+            self._vectors.clear()
+            self._fingerprints.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
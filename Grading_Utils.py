@@ -0,0 +1,207 @@
+import re
+import string
+import unicodedata
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+CORRECT = "correct"
+INCORRECT = "incorrect"
+AMBIGUOUS = "ambiguous"
+
+# "B", "(b)", "b)", "b.", "option b", "answer: b"
+_OPTION_LETTER = re.compile(r"^(?:option|answer|choice)?\s*:?\s*\(?([a-h])\)?[.):]?$", re.IGNORECASE)
+# "B) sat", "(b) sat", "b. sat", "answer: b) sat"
+_OPTION_LETTER_TEXT = re.compile(r"^(?:option|answer|choice)?\s*:?\s*\(?([a-h])[.):]\s*(.+)$", re.IGNORECASE | re.DOTALL)
+# "B) the cat" / "(b) the cat" / "b. the cat" at the start of a line or after whitespace
+_OPTION_LINE = re.compile(r"(?:^|\s)\(?([A-Ha-h])[.)]\s*(.+?)(?=\s+\(?[A-Ha-h][.)]\s|\n|$)")
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+# Apostrophes are kept: "its" and "it's" are different answers
+_PUNCTUATION = str.maketrans("", "", string.punctuation.replace("'", ""))
+# "no mistakes", "nothing wrong", "without any errors" are praise, not criticism
+_NEGATED_NEGATIVE = re.compile(r"\b(?:no|not|nothing|without)\s+(?:any\s+|a\s+single\s+)?(?:mistakes?|errors?|wrong)\b")
+# "Nice try! The correct answer is ..." is how feedback on a wrong answer reads
+_NEGATIVE_FEEDBACK = re.compile(r"\b(?:incorrect|not (?:quite|correct|right)|try again|mistakes?|errors?|wrong|nice try"
+                                r"|the (?:correct|right) answer (?:is|was|would be))\b")
+# A bare "correct" is not praise ("the correct form is ..."); it has to open
+# the feedback or say the answer is correct
+_POSITIVE_FEEDBACK = re.compile(r"^correct\b|\b(?:well done|(?:great|good) job|congratulat\w*|excellent"
+                                r"|(?:that's|that is|you're|you are|it's|it is|answer is) (?:right|correct))\b")
+
+
+@dataclass
+class GradeResult:
+    verdict: str
+    student_answer: str
+    correct_answer: str
+    score: float = 0.0
+
+    @property
+    def decided(self) -> bool:
+        return self.verdict != AMBIGUOUS
+
+
+def normalise_answer(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").translate(_QUOTES).lower()
+    text = text.translate(_PUNCTUATION)
+    return " ".join(text.split())
+
+
+def accepted_answers(correct_answer: str) -> List[str]:
+    # Several accepted answers can be given separated by "|"
+    answers = [normalise_answer(answer) for answer in correct_answer.split("|")]
+    return [answer for answer in answers if answer]
+
+
+def option_letter(text: str) -> Optional[str]:
+    match = _OPTION_LETTER.match((text or "").strip())
+    return match.group(1).lower() if match else None
+
+
+def option_letter_with_text(text: str) -> Optional[Tuple[str, str]]:
+    # An option letter followed by the option's text, as (letter, normalised text)
+    match = _OPTION_LETTER_TEXT.match((text or "").strip())
+    if match is None:
+        return None
+    return match.group(1).lower(), normalise_answer(match.group(2))
+
+
+def _chosen_option(text: str, options: Dict[str, str], fuzzy_threshold: float) -> Optional[str]:
+    # The option a response selects, or None when it names none or contradicts itself
+    letter = option_letter(text)
+    if letter is not None:
+        return letter
+    labelled = option_letter_with_text(text)
+    if labelled is not None:
+        letter, option_text = labelled
+        # Only trust the letter when its text agrees with that option
+        if letter in options and similarity(option_text, options[letter]) >= fuzzy_threshold:
+            return letter
+        return None
+    if not options:
+        return None
+    # Match option text, tolerating small typos when one option is a clear winner
+    student = normalise_answer(text)
+    ranked = sorted(((similarity(student, option), letter) for letter, option in options.items()), reverse=True)
+    best_score, best_letter = ranked[0]
+    runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+    if best_score == 1.0 or (best_score >= fuzzy_threshold and best_score - runner_up >= 0.2):
+        return best_letter
+    return None
+
+
+def _letter_or_text(text: str, normalised: str, options: Dict[str, str]) -> bool:
+    # A bare letter that is also the text of a different option
+    letter = option_letter(normalised) if text.strip().rstrip(".").lower() == normalised else None
+    return letter is not None and any(option == normalised and other != letter for other, option in options.items())
+
+
+def parse_options(*texts: str) -> Dict[str, str]:
+    options: Dict[str, str] = {}
+    for text in texts:
+        for letter, option in _OPTION_LINE.findall(text or ""):
+            options.setdefault(letter.lower(), normalise_answer(option))
+    return options
+
+
+def similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _best_match(answer: str, accepted: List[str]) -> float:
+    return max((similarity(answer, candidate) for candidate in accepted), default=0.0)
+
+
+def grade_mcq(question: str, context: str, correct_answer: str, student_response: str,
+              fuzzy_threshold: float = 0.85) -> GradeResult:
+    """Grade a multiple choice answer without calling a model.
+
+    Option letters, option text and a letter followed by its option text
+    ("B) sat") are accepted; option text is fuzzy matched against the
+    options parsed from the question/context. A letter whose text names a
+    different option, or a bare letter that is also another option's text,
+    is left ambiguous. An
+    answer is only marked incorrect when it clearly selects a different
+    option; anything else that does not match is left ambiguous for the LLM.
+    """
+    options = parse_options(question, context)
+    student = normalise_answer(student_response)
+    student_letter = _chosen_option(student_response, options, fuzzy_threshold)
+
+    correct_letter = option_letter(correct_answer)
+    labelled = option_letter_with_text(correct_answer) if correct_letter is None else None
+    if labelled is not None and labelled[0] in options:
+        correct_letter = labelled[0]
+    accepted = accepted_answers(correct_answer)
+    if correct_letter is not None and correct_letter in options:
+        accepted.append(options[correct_letter])
+    elif correct_letter is None:
+        correct_letter = next((letter for letter, option in options.items() if option in accepted), None)
+
+    result = GradeResult(AMBIGUOUS, student_response, correct_answer)
+    if not student:
+        return result
+    if _letter_or_text(student_response, student, options) or \
+            _letter_or_text(correct_answer, normalise_answer(correct_answer), options):
+        # "a" is option A's letter but option B's text ("A) an B) a")
+        return result
+    chose_option = student_letter is not None and correct_letter is not None
+    if chose_option and (not options or student_letter in options):
+        # The selected option decides, so "A)" is not read as the text "a"
+        if student_letter == correct_letter:
+            result.verdict, result.score = CORRECT, 1.0
+        else:
+            result.verdict, result.score = INCORRECT, _best_match(student, accepted)
+        return result
+    if student in accepted:
+        result.verdict, result.score = CORRECT, 1.0
+        return result
+    result.score = _best_match(student, accepted)
+    return result
+
+
+def grade_fill_blank(question: str, context: str, correct_answer: str, student_response: str,
+                     reject_threshold: float = 0.5) -> GradeResult:
+    """Grade a fill in the blank answer without calling a model.
+
+    Exact matches after normalisation are correct. Answers whose fuzzy
+    similarity to every accepted answer is below ``reject_threshold`` are
+    incorrect; near misses (spelling slips, a word out of place) are
+    ambiguous and go to the LLM.
+    """
+    student = normalise_answer(student_response)
+    accepted = accepted_answers(correct_answer)
+    result = GradeResult(AMBIGUOUS, student_response, correct_answer)
+    if not student or not accepted:
+        return result
+    if student in accepted:
+        result.verdict, result.score = CORRECT, 1.0
+        return result
+
+    result.score = _best_match(student, accepted)
+    if result.score < reject_threshold:
+        result.verdict = INCORRECT
+    return result
+
+
+def templated_feedback(result: GradeResult) -> str:
+    if result.verdict == CORRECT:
+        return (f"Correct! '{result.student_answer.strip()}' is the right answer. "
+                "Well done, let's move on to the next exercise.")
+    return (f"Not quite, '{result.student_answer.strip()}' isn't the right answer. "
+            "Have another look at the question and try again.")
+
+
+def feedback_score(feedback: str) -> Optional[float]:
+    # Rough verdict of free-text model feedback: 1.0, 0.0 or None when it is
+    # unclear or mixed ("Correct! Now try again with ..."), so a guess never
+    # counts as a wrong answer
+    text = " ".join((feedback or "").translate(_QUOTES).lower().split())
+    praised = bool(_NEGATED_NEGATIVE.search(text))
+    text = _NEGATED_NEGATIVE.sub(" ", text)
+    criticised = bool(_NEGATIVE_FEEDBACK.search(text))
+    praised = praised or bool(_POSITIVE_FEEDBACK.search(_NEGATIVE_FEEDBACK.sub(" ", text)))
+    if praised == criticised:
+        return None
+    return 1.0 if praised else 0.0
+
@@ -0,0 +1,226 @@
+import atexit
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import JSON, Float, String, create_engine, inspect, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+
+class Base(DeclarativeBase):
+    pass
+
+
+class LearnerProfileRow(Base):
+    __tablename__ = "learner_profiles"
+
+    student_id: Mapped[str] = mapped_column(String(128), primary_key=True)
+    # skill -> [mastery, attempts, last practised]
+    skills: Mapped[Dict[str, List[float]]] = mapped_column(JSON, default=dict)
+    recent_errors: Mapped[List[str]] = mapped_column(JSON, default=list)
+    notes: Mapped[Optional[List[str]]] = mapped_column(JSON, default=list)
+    updated_at: Mapped[float] = mapped_column(Float)
+
+
+@dataclass
+class LearnerProfile:
+    student_id: str
+    skills: Dict[str, List[float]] = field(default_factory=dict)
+    recent_errors: List[str] = field(default_factory=list)
+    # The supervisor's latest free-text notes, newest last
+    notes: List[str] = field(default_factory=list)
+    updated_at: float = 0.0
+
+    def update(self, skill: str, score: Optional[float], error_tags: Iterable[str], alpha: float,
+               max_skills: int, max_errors: int) -> None:
+        now = time.time()
+        if score is not None:
+            mastery, attempts, _ = self.skills.get(skill, [0.5, 0, now])
+            # Exponential moving average: recent answers count most
+            self.skills[skill] = [mastery + alpha * (min(max(score, 0.0), 1.0) - mastery), attempts + 1, now]
+            if len(self.skills) > max_skills:
+                del self.skills[min(self.skills, key=lambda name: self.skills[name][2])]
+        self.recent_errors.extend(error_tags)
+        del self.recent_errors[:-max_errors]
+        self.updated_at = now
+
+    def add_note(self, note: str, max_notes: int, max_length: int) -> None:
+        note = " ".join(note.split())
+        if len(note) > max_length:
+            note = note[:max_length - 3].rstrip() + "..."
+        if note:
+            self.notes.append(note)
+            del self.notes[:-max_notes]
+            self.updated_at = time.time()
+
+    def digest(self, max_skills: int = 3, max_errors: int = 3, max_name: int = 40) -> str:
+        """A few lines summarising the profile; the same size however long the history."""
+        if not self.skills and not self.recent_errors and not self.notes:
+            return "No learning history yet."
+        ranked = sorted(self.skills.items(), key=lambda item: item[1][0])
+        render = lambda items: ", ".join(f"{name[:max_name]} ({values[0]:.2f})" for name, values in items) or "none yet"
+        lines = []
+        if ranked:
+            average = sum(values[0] for _, values in ranked) / len(ranked)
+            attempts = sum(int(values[1]) for _, values in ranked)
+            lines.append(f"Average mastery {average:.2f} over {len(ranked)} skills and {attempts} graded answers")
+            lines.append(f"Strengths: {render([item for item in reversed(ranked) if item[1][0] >= 0.5][:max_skills])}")
+            lines.append(f"Needs work: {render([item for item in ranked if item[1][0] < 0.5][:max_skills])}")
+        if self.recent_errors:
+            counts = Counter(self.recent_errors).most_common(max_errors)
+            lines.append("Recent errors: " + ", ".join(f"{tag} x{count}" for tag, count in counts))
+        if self.notes:
+            lines.append(f"Latest note: {self.notes[-1]}")
+        return "\n".join(lines)
+
+
+class LearnerProfileStore:
+    """Per-student skill mastery and recent error tags, persisted to SQLite.
+
+    Each graded answer updates the student's mastery of a skill (an
+    exponential moving average of scores in [0, 1]) and appends its error
+    tags to a short rolling list. The supervisor's free-text notes are kept
+    apart from both, in their own short list. Updates apply to the in-memory profile
+    immediately; changed profiles are written back in one batch every
+    ``flush_interval`` seconds, or sooner once ``flush_batch`` of them are
+    waiting. With ``path=None`` profiles live in memory only.
+    """
+
+    def __init__(self, path: Optional[str] = "learner_profiles.db", flush_interval: float = 5.0, flush_batch: int = 100,
+                 max_cached: int = 10000, alpha: float = 0.3, max_skills: int = 50, max_errors: int = 10,
+                 max_notes: int = 5, max_note_length: int = 200):
+        self.engine = None
+        if path is not None:
+            self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+            Base.metadata.create_all(self.engine)
+            if "notes" not in {column["name"] for column in inspect(self.engine).get_columns("learner_profiles")}:
+                # Stores created before notes were kept
+                with self.engine.begin() as connection:
+                    connection.execute(text("ALTER TABLE learner_profiles ADD COLUMN notes JSON"))
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_cached = max_cached
+        self.alpha = alpha
+        self.max_skills = max_skills
+        self.max_errors = max_errors
+        self.max_notes = max_notes
+        self.max_note_length = max_note_length
+        self.stats = {"updates": 0, "flushes": 0, "rows_written": 0, "loads": 0}
+        self._profiles: "OrderedDict[str, LearnerProfile]" = OrderedDict()
+        self._dirty: Dict[str, LearnerProfile] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._writer: Optional[threading.Thread] = None
+        if self.engine is not None:
+            self._writer = threading.Thread(target=self._write_behind, name="learner-profiles", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
+
+    def _load(self, student_id: str) -> LearnerProfile:
+        if self.engine is not None:
+            with Session(self.engine) as session:
+                row = session.get(LearnerProfileRow, student_id)
+                self.stats["loads"] += 1
+                if row is not None:
+                    return LearnerProfile(student_id, dict(row.skills), list(row.recent_errors), list(row.notes or []),
+                                          row.updated_at)
+        return LearnerProfile(student_id)
+
+    def get(self, student_id: str) -> LearnerProfile:
+        with self._lock:
+            profile = self._profiles.get(student_id)
+            if profile is not None:
+                self._profiles.move_to_end(student_id)
+                return profile
+        profile = self._load(student_id)
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep the first copy
+            profile = self._profiles.setdefault(student_id, profile)
+            self._profiles.move_to_end(student_id)
+            # Memory-only profiles have nowhere else to live, so are never evicted
+            while self.engine is not None and len(self._profiles) > self.max_cached:
+                evicted, _ = self._profiles.popitem(last=False)
+                if evicted in self._dirty:
+                    # Not written yet; keep it until the next flush
+                    self._profiles[evicted] = self._dirty[evicted]
+                    break
+        return profile
+
+    def record(self, student_id: str, skill: str, score: Optional[float], error_tags: Iterable[str] = ()) -> LearnerProfile:
+        profile = self.get(student_id)
+        with self._lock:
+            profile.update(skill, score, list(error_tags), self.alpha, self.max_skills, self.max_errors)
+            self._changed(profile)
+        return profile
+
+    def record_note(self, student_id: str, note: str) -> LearnerProfile:
+        profile = self.get(student_id)
+        with self._lock:
+            profile.add_note(note, self.max_notes, self.max_note_length)
+            self._changed(profile)
+        return profile
+
+    def _changed(self, profile: LearnerProfile) -> None:
+        # Called with self._lock held
+        self.stats["updates"] += 1
+        if self.engine is not None:
+            self._dirty[profile.student_id] = profile
+            if len(self._dirty) >= self.flush_batch:
+                self._wake.set()
+
+    def digest(self, student_id: str) -> str:
+        profile = self.get(student_id)
+        with self._lock:
+            return profile.digest()
+
+    def flush(self) -> int:
+        """Write every changed profile to the database now."""
+        if self.engine is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+                rows = [{"student_id": p.student_id, "skills": {k: list(v) for k, v in p.skills.items()},
+                         "recent_errors": list(p.recent_errors), "notes": list(p.notes), "updated_at": p.updated_at}
+                        for p in dirty.values()]
+            if not rows:
+                return 0
+            statement = insert(LearnerProfileRow)
+            statement = statement.on_conflict_do_update(
+                index_elements=[LearnerProfileRow.student_id],
+                set_={name: statement.excluded[name] for name in ("skills", "recent_errors", "notes", "updated_at")},
+            )
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(statement, rows)
+            except Exception:
+                with self._lock:
+                    # Retry on the next flush unless the profile changed again since
+                    for profile in dirty.values():
+                        self._dirty.setdefault(profile.student_id, profile)
+                raise
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(rows)
+            return len(rows)
+
+    def _write_behind(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                pass  # kept dirty; the next flush tries again
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
@@ -0,0 +1,282 @@
+import asyncio
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from Agent_Utils import FeedbackTools
+from Grading_Utils import AMBIGUOUS, CORRECT, INCORRECT, feedback_score
+from Stream_Utils import strip_reasoning
+
+if TYPE_CHECKING:
+    from Curriculum_Store import CurriculumStore
+
+INTRODUCE = "introduce"
+PRESENT_EXERCISE = "present_exercise"
+GRADE = "grade"
+RECORD_FEEDBACK = "record_feedback"
+PLAN = "plan"
+DONE = "done"
+
+_WORD = re.compile(r"\w+")
+# Too common to say which note is relevant
+_STOPWORDS = frozenset("""a an the and or but if of to in on at by for with from as is are was were be been it its this
+that these those i you he she we they me him her us them my your his our their what which who how do does did not
+no so than then there here can will would should could has have had about into""".split())
+
+
+def content_words(text: str) -> FrozenSet[str]:
+    return frozenset(word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS)
+
+
+def rank_snippets(query: str, snippets: List[str], k: int,
+                  snippet_words: Optional[List[FrozenSet[str]]] = None) -> List[str]:
+    # The k snippets sharing the most content words with the query; the cost
+    # depends on the lesson's notes only, not on the size of the curriculum
+    words = content_words(query)
+    if not words:
+        return []
+    snippet_words = snippet_words if snippet_words is not None else [content_words(snippet) for snippet in snippets]
+    scored = [(len(words & snippet_words[i]), i) for i in range(len(snippets))]
+    best = sorted((item for item in scored if item[0]), key=lambda item: (-item[0], item[1]))[:k]
+    return [snippets[i] for _, i in best]
+
+
+@dataclass
+class Exercise:
+    kind: str  # "comprehension", "mcq", "fill_blank" or "pronunciation"
+    question: str
+    correct_answer: str = ""
+    context: str = ""
+    exercise_id: Optional[int] = None
+
+
+@dataclass
+class Lesson:
+    title: str
+    introduction: str
+    exercises: List[Exercise] = field(default_factory=list)
+    # Explanation notes retrieved into the tutor prompt, see Curriculum_Store
+    snippets: List[str] = field(default_factory=list)
+    lesson_id: Optional[int] = None
+
+
+# The lesson that used to be pasted into the tutor prompt
+default_lesson = Lesson(
+    title="Grammar Basics",
+    introduction="Grammar Basics: the subject and predicate of a sentence",
+    exercises=[
+        Exercise(
+            kind="comprehension",
+            question="Identify the subject and predicate in the following sentence: 'The cat sat on the mat.'",
+            correct_answer="Subject: 'The cat'. Predicate: 'sat on the mat'.",
+        ),
+    ],
+    snippets=[
+        "The subject is the person or thing a sentence is about. It usually comes before the verb.",
+        "The predicate tells us what the subject does or is. It contains the verb and everything that follows it.",
+    ],
+)
+
+class LessonContext:
+    """The lesson material a session's tutor sees on each turn.
+
+    Holds the current lesson and exercise; ``material`` renders just the
+    current exercise and the few snippets most relevant to the student's
+    input, so the tutor prompt stays the same size however large the
+    curriculum grows.
+    """
+
+    def __init__(self, lesson: Lesson, store: Optional["CurriculumStore"] = None, max_snippets: int = 3):
+        self.lesson = lesson
+        self.store = store
+        self.max_snippets = max_snippets
+        self.exercise: Optional[Exercise] = lesson.exercises[0] if lesson.exercises else None
+
+    def exercise_text(self) -> str:
+        if self.exercise is None:
+            return self.lesson.title
+        return f"{self.exercise.context}\n{self.exercise.question}".strip()
+
+    def exercise_fields(self) -> Tuple[str, str, str]:
+        # (question, context, correct answer) of the current exercise, as the
+        # feedback cache keys it
+        if self.exercise is None:
+            return self.lesson.title, "", ""
+        return self.exercise.question, self.exercise.context, self.exercise.correct_answer
+
+    def snippets(self, query: str) -> List[str]:
+        if self.store is not None and self.lesson.lesson_id is not None:
+            return self.store.search_snippets(f"{self.exercise_text()} {query}", self.lesson.lesson_id, self.max_snippets)
+        # Lessons that are not in a store carry their notes inline
+        return rank_snippets(f"{self.exercise_text()} {query}", self.lesson.snippets, self.max_snippets)
+
+    def material(self, query: str = "") -> str:
+        lines = [f"Lesson: {self.lesson.title}"]
+        if self.exercise is not None:
+            lines.append(f"Current exercise ({self.exercise.kind}): {self.exercise_text()}")
+            if self.exercise.correct_answer:
+                lines.append(f"Answer key: {self.exercise.correct_answer}")
+        notes = self.snippets(query)
+        if notes:
+            lines.append("Notes:")
+            lines.extend(f"- {note}" for note in notes)
+        return "\n".join(lines)
+
+
+plan_prompt = """You are a supervisor agent responsible for managing an English tutoring session.
+The student has just finished the lesson "{title}".
+Their learner profile (mastery from 0 to 1):
+{profile}
+Assess the student's current English level from this profile and plan the next lesson.
+Reply with the next lesson's topic, its learning objectives and two or three exercise ideas."""
+
+
+class LessonOrchestrator:
+    """Runs a lesson as an explicit state machine instead of a ReAct loop.
+
+    introduce -> present exercise -> grade -> record feedback -> next
+    exercise (or retry) -> plan. Introducing, presenting and recording are
+    deterministic and call the tools directly; grading goes through
+    FeedbackTools (local grader, cache, then the tutor model); only planning
+    the next lesson asks the supervisor model.
+
+    ``turn_metrics`` compares the model calls each turn made with the calls
+    the supervisor agent would have needed: one ReAct hop per tool it calls,
+    one for its final answer and one tutor call for feedback.
+    """
+
+    def __init__(self, lesson: Lesson, tools: Dict[str, Any], feedback_tools: FeedbackTools,
+                 planner: Optional[Any] = None, max_attempts: int = 2, lesson_context: Optional[LessonContext] = None):
+        # tools: the session's tools by name, see app.build_tools. The lesson
+        # context, if given, is kept pointing at the current exercise.
+        self.lesson = lesson
+        self.lesson_context = lesson_context
+        self.tools = tools
+        self.feedback_tools = feedback_tools
+        self.planner = planner
+        self.max_attempts = max_attempts
+        self.state = INTRODUCE
+        self.exercise_index = 0
+        self.attempts = 0
+        self.plan: Optional[str] = None
+        self.turn_metrics: List[Dict[str, int]] = []
+        self._turn: Dict[str, int] = {}
+        self._llm_calls_before = 0
+
+    @property
+    def current_exercise(self) -> Optional[Exercise]:
+        if self.exercise_index < len(self.lesson.exercises):
+            return self.lesson.exercises[self.exercise_index]
+        return None
+
+    def _call_tool(self, name: str, tool_input: str) -> str:
+        self._turn["tool_steps"] += 1
+        return self.tools[name]._run(tool_input)
+
+    def _begin_turn(self) -> None:
+        self._turn = {"tool_steps": 0, "graded": 0, "llm_calls": 0}
+        self._llm_calls_before = self.feedback_tools.llm_calls
+
+    def _end_turn(self) -> None:
+        turn = self._turn
+        turn["llm_calls"] += self.feedback_tools.llm_calls - self._llm_calls_before
+        turn["baseline_llm_calls"] = turn["tool_steps"] + 1 + turn["graded"]
+        turn["llm_calls_saved"] = turn["baseline_llm_calls"] - turn["llm_calls"]
+        self.turn_metrics.append(turn)
+
+    def start(self) -> str:
+        """Introduce the lesson and present the first exercise."""
+        self._begin_turn()
+        replies = [self._call_tool("introduce_lesson", self.lesson.introduction)]
+        if self.current_exercise is not None:
+            self.state = PRESENT_EXERCISE
+            replies.append(self._present())
+        else:
+            # Nothing to practise; go straight to planning the next lesson
+            self.state = PLAN
+            replies.append(self._plan())
+        self._end_turn()
+        return "\n\n".join(reply for reply in replies if reply)
+
+    def handle(self, student_response: str) -> str:
+        """Grade the student's answer, record it and move the lesson on."""
+        if self.state == INTRODUCE:
+            return self.start()
+        if self.state == DONE:
+            return self.plan or "This lesson is complete."
+        self._begin_turn()
+        self.state = GRADE
+        feedback, finished = self._grade(student_response)
+        self.state = RECORD_FEEDBACK
+        self._record(student_response, feedback)
+        replies = [feedback]
+        if finished:
+            self.exercise_index += 1
+            self.attempts = 0
+            if self.lesson_context is not None:
+                self.lesson_context.exercise = self.current_exercise
+        self.state = PRESENT_EXERCISE if self.current_exercise is not None else PLAN
+        if self.state == PRESENT_EXERCISE and finished:
+            replies.append(self._present())
+        elif self.state == PLAN:
+            replies.append(self._plan())
+        self._end_turn()
+        return "\n\n".join(reply for reply in replies if reply)
+
+    async def ahandle(self, student_response: str) -> str:
+        return await asyncio.to_thread(self.handle, student_response)
+
+    async def astart(self) -> str:
+        return await asyncio.to_thread(self.start)
+
+    def _present(self) -> str:
+        exercise = self.current_exercise
+        text = exercise.question if not exercise.context else f"{exercise.context}\n\n{exercise.question}"
+        return self._call_tool("read_exercise", text)
+
+    def _grade(self, student_response: str) -> Tuple[str, bool]:
+        exercise = self.current_exercise
+        grader: Optional[Callable[..., str]] = {
+            "comprehension": self.feedback_tools.comp_question_feedback,
+            "mcq": self.feedback_tools.mcq_question_feedback,
+            "fill_blank": self.feedback_tools.fill_blank_question_feedback,
+        }.get(exercise.kind)
+        if grader is None and exercise.kind != "pronunciation":
+            raise ValueError(f"Unknown exercise kind {exercise.kind!r} in lesson {self.lesson.title!r}")
+        self._turn["graded"] = 1
+        self.attempts += 1
+        if grader is not None:
+            feedback = grader(exercise.question, exercise.context, exercise.correct_answer, student_response)
+        else:
+            feedback = self.feedback_tools.pronunciation_feedback(exercise.question, exercise.correct_answer, student_response)
+        grade = self.feedback_tools.last_grade
+        # Locally graded wrong answers get another try; everything else moves on
+        retry = grade is not None and grade.verdict == INCORRECT and self.attempts < self.max_attempts
+        return feedback, not retry
+
+    def _record(self, student_response: str, feedback: str) -> None:
+        # Update the learner profile: the lesson is the skill, and wrong or
+        # near-miss answers leave an error tag for their exercise kind
+        exercise = self.current_exercise
+        grade = self.feedback_tools.last_grade
+        if grade is None or grade.verdict == AMBIGUOUS:
+            score = feedback_score(feedback)
+        else:
+            score = 1.0 if grade.verdict == CORRECT else 0.0
+        tags = []
+        if grade is not None and grade.verdict == AMBIGUOUS:
+            tags.append(f"{exercise.kind}:near_miss")
+        elif score == 0.0:
+            tags.append(f"{exercise.kind}:incorrect")
+        self._turn["tool_steps"] += 1
+        self.tools["update_feedback_memory"].record(self.lesson.title, score, tags)
+
+    def _plan(self) -> str:
+        self.state = DONE
+        if self.planner is None:
+            return "That's the end of the lesson. Well done!"
+        profile = self.tools["update_feedback_memory"].digest()
+        response = self.planner.invoke(plan_prompt.format(title=self.lesson.title, profile=profile))
+        self._turn["llm_calls"] += 1
+        self.plan = "".join(strip_reasoning([getattr(response, "content", response)]))
+        return self.plan
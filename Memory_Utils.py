@@ -0,0 +1,180 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+from langchain_core.prompts import PromptTemplate
+from pydantic import PrivateAttr
+
+# Summaries are folded off the request path on a small shared pool
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+summary_prompt = PromptTemplate(
+    input_variables=["summary", "new_lines"],
+    template="""Progressively summarize the tutoring conversation below, adding onto the previous summary.
+Keep the lesson topic, exercises covered, the student's mistakes and their progress. Reply with the new summary only.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:"""
+)
+
+
+def approximate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text; good enough for
+    # budgeting without loading a tokenizer on every turn
+    return (len(text) + 3) // 4
+
+
+class TokenBudgetMemory(BaseChatMemory):
+    """Chat memory with a fixed prompt-token budget.
+
+    The last ``keep_last_turns`` turns are kept verbatim. Older turns are
+    folded into a running summary by ``llm`` in the background; each fold only
+    sends the previous summary and the newly evicted turns, so the summary is
+    updated rather than recomputed. ``load_memory_variables`` never returns
+    more than ``max_token_limit`` tokens: when the summary and the latest
+    turn alone are over budget, the longest of them is cut short. The size
+    of every prompt it builds is recorded in ``turn_metrics``.
+    """
+
+    llm: Any
+    memory_key: str = "chat_history"
+    max_token_limit: int = 1024
+    keep_last_turns: int = 4
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    token_counter: Callable[[str], int] = approximate_tokens
+    summary: str = ""
+    metrics_window: int = 200
+
+    _pending: List[BaseMessage] = PrivateAttr(default_factory=list)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _fold: Optional[Future] = PrivateAttr(default=None)
+    _metrics: Deque[Dict[str, int]] = PrivateAttr(default_factory=deque)
+    _turns: int = PrivateAttr(default=0)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def turn_metrics(self) -> List[Dict[str, int]]:
+        return list(self._metrics)
+
+    @property
+    def last_metrics(self) -> Optional[Dict[str, int]]:
+        return self._metrics[-1] if self._metrics else None
+
+    def _tokens(self, messages: List[BaseMessage]) -> int:
+        return self.token_counter(get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix))
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            summary = self.summary
+            recent = list(self.chat_memory.messages)
+            pending = list(self._pending)
+        summary_messages = [SystemMessage(content=summary)] if summary else []
+        budget = self.max_token_limit - self._tokens(summary_messages)
+        # Turns waiting to be folded are shown verbatim while they still fit,
+        # dropped a whole turn at a time so no reply loses its question
+        while pending and self._tokens(pending + recent) > budget:
+            del pending[0]
+            while pending and not isinstance(pending[0], HumanMessage):
+                del pending[0]
+        messages = self._fit(summary_messages + pending + recent)
+        self._record_metrics(messages[:len(summary_messages)], messages[len(summary_messages):])
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
+
+    def _fit(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        # Cut the longest message short until the whole prompt is in budget
+        messages = list(messages)
+        while messages and self._tokens(messages) > self.max_token_limit:
+            i = max(range(len(messages)), key=lambda j: len(str(messages[j].content)))
+            content = str(messages[i].content)
+            target = self.token_counter(content) - (self._tokens(messages) - self.max_token_limit)
+            low, high = 0, len(content)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.token_counter(content[:middle] + " ...") <= target:
+                    low = middle
+                else:
+                    high = middle - 1
+            truncated = content[:low].rstrip() + " ..."
+            if len(truncated) >= len(content):
+                break  # nothing left to cut
+            messages[i] = messages[i].model_copy(update={"content": truncated})
+        return messages
+
+    def _record_metrics(self, summary_messages: List[BaseMessage], verbatim: List[BaseMessage]) -> None:
+        summary_tokens = self._tokens(summary_messages)
+        verbatim_tokens = self._tokens(verbatim)
+        self._metrics.append({
+            "turn": self._turns,
+            "summary_tokens": summary_tokens,
+            "verbatim_tokens": verbatim_tokens,
+            "prompt_tokens": summary_tokens + verbatim_tokens,
+            "verbatim_messages": len(verbatim),
+        })
+        while len(self._metrics) > self.metrics_window:
+            self._metrics.popleft()
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        with self._lock:
+            self._turns += 1
+            messages = self.chat_memory.messages
+            keep = 2 * self.keep_last_turns
+            summary_tokens = self.token_counter(self.summary)
+            evict = max(len(messages) - keep, 0)
+            # Also evict whole turns while the verbatim window is over budget,
+            # always keeping the latest turn
+            while len(messages) - evict > 2 and self._tokens(messages[evict:]) + summary_tokens > self.max_token_limit:
+                evict += 2
+            if evict:
+                self._pending.extend(messages[:evict])
+                self.chat_memory.messages = messages[evict:]
+        if evict:
+            self._schedule_fold()
+
+    def _schedule_fold(self) -> None:
+        with self._lock:
+            if self._fold is not None and not self._fold.done():
+                # The running fold picks up the new turns when it finishes
+                return
+            self._fold = _summary_pool.submit(self._fold_pending)
+
+    def _fold_pending(self) -> None:
+        while True:
+            with self._lock:
+                batch = list(self._pending)
+                summary = self.summary
+            if not batch:
+                return
+            new_lines = get_buffer_string(batch, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+            new_summary = self.llm.invoke(summary_prompt.format(summary=summary, new_lines=new_lines))
+            with self._lock:
+                self.summary = getattr(new_summary, "content", new_summary).strip()
+                del self._pending[:len(batch)]
+
+    def wait_for_summary(self, timeout: Optional[float] = None) -> None:
+        fold = self._fold
+        if fold is not None:
+            fold.result(timeout=timeout)
+
+    def clear(self) -> None:
+        self.wait_for_summary()
+        super().clear()
+        with self._lock:
+            self.summary = ""
+            self._pending.clear()
+            self._metrics.clear()
+            self._turns = 0
@@ -0,0 +1,104 @@
+import asyncio
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Wall-clock breakdown of process start-up: imports, model construction and
+# warm-up, in the order they happened
+startup_timings: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(label: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[label] = startup_timings.get(label, 0.0) + time.perf_counter() - start
+
+
+def lazy_import(module_name: str) -> Any:
+    # Import a heavy or optional dependency on first use and record how long it took
+    module = sys.modules.get(module_name)
+    if module is None:
+        with timed(f"import {module_name}"):
+            module = importlib.import_module(module_name)
+    return module
+
+
+def startup_report() -> str:
+    lines = [f"{label:<40} {seconds * 1000:8.1f} ms" for label, seconds in startup_timings.items()]
+    lines.append(f"{'total':<40} {sum(startup_timings.values()) * 1000:8.1f} ms")
+    return "\n".join(lines)
+
+
+class ModelRegistry:
+    """Builds models and agents the first time they are asked for.
+
+    Factories are registered by name and run at most once, so importing a
+    module that registers them costs nothing until a model is actually used.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        # Re-entrant: a factory may get() the models it is built from
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    if name not in self._factories:
+                        raise KeyError(f"No model or agent registered as '{name}'")
+                    with timed(f"build {name}"):
+                        instance = self._instances[name] = self._factories[name]()
+        return instance
+
+    def get_or_register(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._factories.setdefault(name, factory)
+        return self.get(name)
+
+    def loaded(self) -> List[str]:
+        return list(self._instances)
+
+    def _ollama_models(self, names: Optional[List[str]]) -> List[Any]:
+        models = [self.get(name) for name in (names or list(self._factories))]
+        return [model for model in models if hasattr(model, "base_url") and hasattr(model, "keep_alive")]
+
+    def warm_up(self, names: Optional[List[str]] = None, keep_alive: str = "30m") -> None:
+        """Load the named Ollama models (all by default) into server memory.
+
+        An empty generate request makes Ollama load the weights without
+        producing tokens; ``keep_alive`` is also set on the models so later
+        requests keep them resident.
+        """
+        ollama = lazy_import("ollama")
+        for model in self._ollama_models(names):
+            model.keep_alive = keep_alive
+            with timed(f"warm up {model.model}"):
+                ollama.Client(host=model.base_url).generate(model=model.model, prompt="", keep_alive=keep_alive)
+
+    async def awarm_up(self, names: Optional[List[str]] = None, keep_alive: str = "30m") -> None:
+        ollama = lazy_import("ollama")
+
+        async def load(model: Any) -> None:
+            model.keep_alive = keep_alive
+            with timed(f"warm up {model.model}"):
+                await ollama.AsyncClient(host=model.base_url).generate(model=model.model, prompt="", keep_alive=keep_alive)
+
+        await asyncio.gather(*(load(model) for model in self._ollama_models(names)))
+
+
+registry = ModelRegistry()
@@ -0,0 +1,139 @@
+import asyncio
+import re
+import statistics
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from Grading_Utils import normalise_answer, similarity
+from Stream_Utils import strip_reasoning
+
+_CONFIDENCE = re.compile(r"^\W*confidence\W*(\d{1,3})\s*%?\W*$", re.IGNORECASE | re.MULTILINE)
+
+confidence_suffix = """
+
+After your reply, write one final line of the form "Confidence: N" where N (0-100) is how sure you are that your feedback is correct."""
+
+
+def split_confidence(text: str) -> Tuple[str, Optional[int]]:
+    # Separate the self-reported confidence line from the reply
+    matches = list(_CONFIDENCE.finditer(text))
+    if not matches:
+        return text.strip(), None
+    match = matches[-1]
+    reply = (text[:match.start()] + text[match.end():]).strip()
+    return reply, min(int(match.group(1)), 100)
+
+
+class CascadeRouter:
+    """Answers with the small model first and escalates only when needed.
+
+    Exercise kinds in ``escalate_kinds`` (open-ended comprehension and
+    pronunciation feedback by default) go straight to the large model. Other
+    prompts are answered by the small model, which also reports its
+    confidence; replies below ``min_confidence``, or that disagree with each
+    other when ``consistency_samples`` > 1, are re-asked of the large model.
+    ``metrics()`` reports the escalation rate and per-model latency.
+    """
+
+    def __init__(self, small: Any, large: Any, min_confidence: int = 70, consistency_samples: int = 1,
+                 min_agreement: float = 0.6, escalate_kinds: Iterable[str] = ("comprehension", "pronunciation"),
+                 latency_window: int = 1000):
+        self.small = small
+        self.large = large
+        self.min_confidence = min_confidence
+        self.consistency_samples = consistency_samples
+        self.min_agreement = min_agreement
+        self.escalate_kinds = set(escalate_kinds)
+        self.latency_window = latency_window
+        self.counts = {"requests": 0, "small": 0, "escalated": 0, "low_confidence": 0, "disagreement": 0, "by_kind": 0}
+        self.latencies: Dict[str, List[float]] = {"small": [], "large": []}
+        self._lock = threading.Lock()
+
+    def _record(self, model: str, seconds: float) -> None:
+        with self._lock:
+            latencies = self.latencies[model]
+            latencies.append(seconds)
+            if len(latencies) > self.latency_window:
+                del latencies[:len(latencies) - self.latency_window]
+
+    def _count(self, *keys: str) -> None:
+        with self._lock:
+            for key in keys:
+                self.counts[key] += 1
+
+    @staticmethod
+    def _text(response: Any) -> str:
+        return getattr(response, "content", response)
+
+    def _judge(self, replies: List[Tuple[str, Optional[int]]]) -> Optional[str]:
+        # The reason to escalate, or None to keep the small model's reply
+        confidences = [confidence for _, confidence in replies]
+        if any(confidence is None or confidence < self.min_confidence for confidence in confidences):
+            return "low_confidence"
+        texts = [normalise_answer(reply) for reply, _ in replies]
+        if any(similarity(texts[0], other) < self.min_agreement for other in texts[1:]):
+            return "disagreement"
+        return None
+
+    def _large_reply(self, response: Any) -> str:
+        return "".join(strip_reasoning([self._text(response)])).strip()
+
+    def route(self, prompt: str, kind: Optional[str] = None) -> str:
+        self._count("requests")
+        if kind in self.escalate_kinds:
+            return self._escalate(prompt, "by_kind")
+        replies = []
+        for _ in range(max(self.consistency_samples, 1)):
+            start = time.perf_counter()
+            response = self.small.invoke(prompt + confidence_suffix)
+            self._record("small", time.perf_counter() - start)
+            replies.append(split_confidence(self._text(response)))
+        reason = self._judge(replies)
+        if reason is not None:
+            return self._escalate(prompt, reason)
+        self._count("small")
+        return replies[0][0]
+
+    def _escalate(self, prompt: str, reason: str) -> str:
+        self._count("escalated", reason)
+        start = time.perf_counter()
+        response = self.large.invoke(prompt)
+        self._record("large", time.perf_counter() - start)
+        return self._large_reply(response)
+
+    async def aroute(self, prompt: str, kind: Optional[str] = None) -> str:
+        self._count("requests")
+        if kind in self.escalate_kinds:
+            return await self._aescalate(prompt, "by_kind")
+
+        async def sample() -> Tuple[str, Optional[int]]:
+            start = time.perf_counter()
+            response = await self.small.ainvoke(prompt + confidence_suffix)
+            self._record("small", time.perf_counter() - start)
+            return split_confidence(self._text(response))
+
+        replies = list(await asyncio.gather(*(sample() for _ in range(max(self.consistency_samples, 1)))))
+        reason = self._judge(replies)
+        if reason is not None:
+            return await self._aescalate(prompt, reason)
+        self._count("small")
+        return replies[0][0]
+
+    async def _aescalate(self, prompt: str, reason: str) -> str:
+        self._count("escalated", reason)
+        start = time.perf_counter()
+        response = await self.large.ainvoke(prompt)
+        self._record("large", time.perf_counter() - start)
+        return self._large_reply(response)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+            latencies = {model: list(values) for model, values in self.latencies.items()}
+        report: Dict[str, Any] = dict(counts)
+        report["escalation_rate"] = counts["escalated"] / counts["requests"] if counts["requests"] else 0.0
+        for model, values in latencies.items():
+            report[f"{model}_p50_seconds"] = statistics.median(values) if values else None
+            report[f"{model}_max_seconds"] = max(values) if values else None
+        return report
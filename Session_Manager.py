@@ -0,0 +1,211 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import app
+from Agent_Utils import FeedbackTools
+from Lesson_Orchestrator import Lesson, LessonContext, LessonOrchestrator, default_lesson
+from Model_Registry import lazy_import, registry
+from Stream_Utils import FinalAnswerFilter, ThinkStripper
+
+if TYPE_CHECKING:
+    from Curriculum_Store import CurriculumStore
+    from Feedback_Cache import FeedbackCache
+    from Learner_Profile import LearnerProfileStore
+
+
+class TutoringSession:
+    """One student's tutor chain, supervisor agent and memories.
+
+    The session id is the student id in the learner profile store.
+    """
+
+    def __init__(self, session_id: str, feedback_cache: Optional["FeedbackCache"] = None,
+                 curriculum: Optional["CurriculumStore"] = None,
+                 learner_profiles: Optional["LearnerProfileStore"] = None):
+        self.session_id = session_id
+        self.curriculum = curriculum
+        self.lesson_context = LessonContext(default_lesson, curriculum)
+        self.tutor_memory = app.build_tutor_memory()
+        self.supervisor_memory = app.build_supervisor_memory()
+        self.tutor_chain = app.build_tutor_chain(self.tutor_memory)
+        self.feedback_cache = feedback_cache
+        # Without a persistent store the profile lasts as long as the session
+        self.learner_profiles = learner_profiles or lazy_import("Learner_Profile").LearnerProfileStore(None)
+        self.tools = app.build_tools(self.tutor_chain, self.learner_profiles, session_id, feedback_cache,
+                                     self.lesson_context)
+        self.supervisor_agent = app.build_supervisor_agent(self.tools, self.supervisor_memory)
+        # Turns within a session are serialised so the memories see them in order
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+        self.stream_metrics: Dict[str, Optional[float]] = {}
+        self.orchestrator: Optional[LessonOrchestrator] = None
+
+    def _supervisor_input(self, user_input: str) -> str:
+        # A fixed-size digest of the student's profile, however long their history
+        return (f"{app.supervisor_system_prompt}\n\nLearner profile:\n{self.learner_profiles.digest(self.session_id)}"
+                f"\n\nStudent input: {user_input}")
+
+    async def run_tutoring_session(self, user_input: str) -> str:
+        async with self.lock:
+            self.last_active = time.monotonic()
+            response = await self.supervisor_agent.arun(input=self._supervisor_input(user_input))
+            self.last_active = time.monotonic()
+            return response
+
+    async def astream_tutoring_session(self, user_input: str) -> AsyncIterator[str]:
+        """Yield the supervisor's final answer token by token as it is generated.
+
+        Only tokens from the supervisor model are considered; its reasoning
+        block and the ReAct steps that call tools are filtered out on the fly.
+        """
+        async with self.lock:
+            start = self.last_active = time.monotonic()
+            first_token = None
+            filters: Dict[Any, Tuple[ThinkStripper, FinalAnswerFilter]] = {}
+            events = self.supervisor_agent.astream_events(
+                {"input": self._supervisor_input(user_input)}, version="v2"
+            )
+            async for event in events:
+                if "supervisor" not in event.get("tags", ()):
+                    continue
+                if event["event"] == "on_llm_stream":
+                    chunk = event["data"]["chunk"]
+                    stripper, answer = filters.setdefault(event["run_id"], (ThinkStripper(), FinalAnswerFilter()))
+                    visible = answer.feed(stripper.feed(getattr(chunk, "text", str(chunk))))
+                elif event["event"] == "on_llm_end" and event["run_id"] in filters:
+                    stripper, answer = filters.pop(event["run_id"])
+                    visible = answer.feed(stripper.flush())
+                else:
+                    continue
+                if visible:
+                    if first_token is None:
+                        first_token = time.monotonic() - start
+                    yield visible
+            self.last_active = time.monotonic()
+            self.stream_metrics = {"time_to_first_token": first_token, "total": self.last_active - start}
+
+    async def start_lesson(self, lesson: Union[Lesson, int] = default_lesson) -> str:
+        # Structured lessons run through the state machine; the supervisor
+        # model is only asked to plan the next lesson. An int is a lesson id
+        # in the curriculum store.
+        if not isinstance(lesson, Lesson):
+            if self.curriculum is None:
+                raise ValueError(f"Lesson id {lesson} given but the session has no curriculum store")
+            lesson = self.curriculum.get_lesson(lesson)
+        async with self.lock:
+            return await self._start_lesson(lesson)
+
+    async def _start_lesson(self, lesson: Lesson) -> str:
+        # Called with self.lock held
+        self.last_active = time.monotonic()
+        self.lesson_context.lesson = lesson
+        self.lesson_context.exercise = lesson.exercises[0] if lesson.exercises else None
+        self.orchestrator = LessonOrchestrator(
+            lesson,
+            {tool.name: tool for tool in self.tools},
+            FeedbackTools(model=registry.get("feedback_router"), cache=self.feedback_cache),
+            planner=registry.get("supervisor_model"),
+            lesson_context=self.lesson_context,
+        )
+        return await self.orchestrator.astart()
+
+    async def run_lesson_turn(self, student_response: str) -> str:
+        async with self.lock:
+            # Checked under the lock so concurrent first turns start one lesson
+            if self.orchestrator is None:
+                await self._start_lesson(default_lesson)
+            self.last_active = time.monotonic()
+            return await self.orchestrator.ahandle(student_response)
+
+    def memory_metrics(self) -> Dict[str, Optional[Dict[str, int]]]:
+        # Prompt-token breakdown of the latest turn for each conversation memory
+        return {
+            "tutor": self.tutor_memory.last_metrics,
+            "supervisor": self.supervisor_memory.last_metrics,
+        }
+
+
+class SessionManager:
+    """Builds isolated tutoring sessions on demand and runs them concurrently.
+
+    In-flight Ollama calls are capped process-wide (see
+    ``Agent_Utils.set_ollama_concurrency``). Idle sessions are evicted after
+    ``idle_timeout`` seconds and the least recently used session is dropped
+    once ``max_sessions`` is reached; sessions in the middle of a turn are
+    never evicted.
+    A shared ``feedback_cache`` lets every session reuse feedback for answers
+    other students have already given, and lessons can be loaded by id from a
+    shared ``curriculum`` store. Student profiles are kept in
+    ``learner_profiles``; pass a LearnerProfileStore with a path to keep them
+    across restarts.
+    """
+
+    def __init__(self, max_sessions: int = 1000, idle_timeout: float = 1800.0,
+                 feedback_cache: Optional["FeedbackCache"] = None, curriculum: Optional["CurriculumStore"] = None,
+                 learner_profiles: Optional["LearnerProfileStore"] = None):
+        self.max_sessions = max_sessions
+        self.feedback_cache = feedback_cache
+        self.curriculum = curriculum
+        self.learner_profiles = learner_profiles
+        self.idle_timeout = idle_timeout
+        self.sessions: "OrderedDict[str, TutoringSession]" = OrderedDict()
+
+    def get_session(self, session_id: str) -> TutoringSession:
+        session = self.sessions.get(session_id)
+        if session is None:
+            self.evict_idle()
+            # Drop the least recently used sessions, skipping any mid-turn;
+            # if every session is busy the limit is briefly exceeded
+            excess = len(self.sessions) - self.max_sessions + 1
+            if excess > 0:
+                free = [key for key, other in self.sessions.items() if not other.lock.locked()]
+                for key in free[:excess]:
+                    del self.sessions[key]
+            if self.learner_profiles is None:
+                # Memory only, but shared so profiles outlive evicted sessions
+                self.learner_profiles = lazy_import("Learner_Profile").LearnerProfileStore(None)
+            session = self.sessions[session_id] = TutoringSession(
+                session_id, self.feedback_cache, self.curriculum, self.learner_profiles
+            )
+        else:
+            self.sessions.move_to_end(session_id)
+        return session
+
+    async def run_tutoring_session(self, session_id: str, user_input: str) -> str:
+        return await self.get_session(session_id).run_tutoring_session(user_input)
+
+    async def start_lesson(self, session_id: str, lesson: Union[Lesson, int] = default_lesson) -> str:
+        return await self.get_session(session_id).start_lesson(lesson)
+
+    async def run_lesson_turn(self, session_id: str, student_response: str) -> str:
+        return await self.get_session(session_id).run_lesson_turn(student_response)
+
+    async def astream_tutoring_session(self, session_id: str, user_input: str) -> AsyncIterator[str]:
+        async for token in self.get_session(session_id).astream_tutoring_session(user_input):
+            yield token
+
+    async def run_many(self, turns: Dict[str, str]) -> Dict[str, str]:
+        # Run one turn for each session concurrently, keyed by session_id
+        session_ids: List[str] = list(turns)
+        responses = await asyncio.gather(
+            *(self.run_tutoring_session(session_id, turns[session_id]) for session_id in session_ids)
+        )
+        return dict(zip(session_ids, responses))
+
+    def end_session(self, session_id: str) -> Optional[TutoringSession]:
+        return self.sessions.pop(session_id, None)
+
+    def evict_idle(self) -> int:
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [
+            session_id for session_id, session in self.sessions.items()
+            if session.last_active < cutoff and not session.lock.locked()
+        ]
+        for session_id in idle:
+            del self.sessions[session_id]
+        return len(idle)
+
+
+default_session_manager = SessionManager()
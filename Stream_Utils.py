@@ -0,0 +1,115 @@
+from typing import AsyncIterator, Iterable, Iterator
+
+
+def _partial_suffix(text: str, marker: str) -> int:
+    # Length of the longest suffix of text that could be the start of marker
+    for size in range(min(len(marker) - 1, len(text)), 0, -1):
+        if marker.startswith(text[-size:]):
+            return size
+    return 0
+
+
+class ThinkStripper:
+    """Removes <think>...</think> reasoning blocks from a token stream.
+
+    Tokens are processed as they arrive; only text that could still turn out
+    to be part of a tag is held back, so the rest of the response is passed
+    through without waiting for the whole completion.
+    """
+
+    open_tag = "<think>"
+    close_tag = "</think>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._thinking = False
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        visible = []
+        while self._buffer:
+            if self._thinking:
+                end = self._buffer.find(self.close_tag)
+                if end == -1:
+                    # Drop the reasoning, keeping a possible partial close tag
+                    self._buffer = self._buffer[len(self._buffer) - _partial_suffix(self._buffer, self.close_tag):]
+                    break
+                self._buffer = self._buffer[end + len(self.close_tag):]
+                self._thinking = False
+                continue
+            start = self._buffer.find(self.open_tag)
+            if start == -1:
+                hold = _partial_suffix(self._buffer, self.open_tag)
+                text, self._buffer = self._buffer[:len(self._buffer) - hold], self._buffer[len(self._buffer) - hold:]
+                visible.append(text)
+                break
+            visible.append(self._buffer[:start])
+            self._buffer = self._buffer[start + len(self.open_tag):]
+            self._thinking = True
+        return self._emit("".join(visible))
+
+    def flush(self) -> str:
+        text = "" if self._thinking else self._buffer
+        self._buffer = ""
+        return self._emit(text)
+
+    def _emit(self, text: str) -> str:
+        # Drop the blank lines models leave between the reasoning and the answer
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        return text
+
+
+class FinalAnswerFilter:
+    """Passes through only the final answer of a conversational ReAct step.
+
+    The conversational agent ends its reply with ``"<ai_prefix>: answer"``;
+    steps that call a tool never contain the prefix, so they emit nothing.
+    """
+
+    def __init__(self, ai_prefix: str = "AI"):
+        self.marker = f"{ai_prefix}:"
+        self._buffer = ""
+        self._answering = False
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        if not self._answering:
+            self._buffer += chunk
+            start = self._buffer.find(self.marker)
+            if start == -1:
+                return ""
+            self._answering = True
+            chunk, self._buffer = self._buffer[start + len(self.marker):], ""
+        if not self._started:
+            chunk = chunk.lstrip()
+            self._started = bool(chunk)
+        return chunk
+
+    def flush(self) -> str:
+        self._buffer = ""
+        return ""
+
+
+def strip_reasoning(chunks: Iterable[str]) -> Iterator[str]:
+    stripper = ThinkStripper()
+    for chunk in chunks:
+        text = stripper.feed(chunk)
+        if text:
+            yield text
+    text = stripper.flush()
+    if text:
+        yield text
+
+
+async def astrip_reasoning(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    stripper = ThinkStripper()
+    async for chunk in chunks:
+        text = stripper.feed(chunk)
+        if text:
+            yield text
+    text = stripper.flush()
+    if text:
+        yield text
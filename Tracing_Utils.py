@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Trace(BaseCallbackHandler):
+    """Per-step record of one traced unit of work (a turn, a feedback call).
+
+    Collects LLM hops, prompt/completion tokens (as reported by Ollama),
+    per-LLM latency and time to first token, per-tool latency and the
+    latency of untraced steps wrapped in ``trace_step``.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.llm_hops = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_seconds: List[float] = []
+        self.ttft_seconds: List[float] = []
+        self.tool_seconds: Dict[str, List[float]] = {}
+        self.step_seconds: Dict[str, List[float]] = {}
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self.llm_hops += 1
+            self._runs[run_id] = {"start": time.perf_counter(), "first_token": None}
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is not None and run["first_token"] is None and token:
+            run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+            if run is None:
+                return
+            self.llm_seconds.append(now - run["start"])
+            if run["first_token"] is not None:
+                self.ttft_seconds.append(run["first_token"] - run["start"])
+            for generations in response.generations:
+                for generation in generations:
+                    info = generation.generation_info or {}
+                    self.prompt_tokens += info.get("prompt_eval_count") or 0
+                    self.completion_tokens += info.get("eval_count") or 0
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._runs[run_id] = {"start": time.perf_counter(), "tool": (serialized or {}).get("name", "tool")}
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+            if run is not None:
+                self.tool_seconds.setdefault(run["tool"], []).append(now - run["start"])
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self.on_tool_end(None, run_id=run_id)
+
+    def record_step(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.step_seconds.setdefault(name, []).append(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "wall_seconds": end - self.started,
+            "llm_hops": self.llm_hops,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "llm_seconds": list(self.llm_seconds),
+            "ttft_seconds": list(self.ttft_seconds),
+            "tool_seconds": {name: list(values) for name, values in self.tool_seconds.items()},
+            "step_seconds": {name: list(values) for name, values in self.step_seconds.items()},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.summary())
+
+
+# The active trace is attached to every LangChain run started in this context,
+# including nested chains, agents, tools and LLM calls
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("feedback_agent_trace", default=None)
+register_configure_hook(_current_trace, inheritable=True)
+
+
+@contextmanager
+def trace(name: str) -> Iterator[Trace]:
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        current.finished = time.perf_counter()
+        _current_trace.reset(token)
+
+
+@contextmanager
+def trace_step(name: str) -> Iterator[None]:
+    # Times a step that does not go through LangChain; free when not tracing
+    current = _current_trace.get()
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.record_step(name, time.perf_counter() - start)
+
+
+def aggregate(traces: List[Trace]) -> Dict[str, Any]:
+    """Summarise many traces: per-trace means and latency percentiles."""
+    summaries = [t.summary() for t in traces]
+    count = len(summaries) or 1
+    flat = lambda key: [value for s in summaries for value in s[key]]
+    report: Dict[str, Any] = {
+        "count": len(summaries),
+        "llm_hops_per_trace": sum(s["llm_hops"] for s in summaries) / count,
+        "prompt_tokens_per_trace": sum(s["prompt_tokens"] for s in summaries) / count,
+        "completion_tokens_per_trace": sum(s["completion_tokens"] for s in summaries) / count,
+    }
+    for key, values in (("wall", [s["wall_seconds"] for s in summaries]), ("llm", flat("llm_seconds")),
+                        ("ttft", flat("ttft_seconds"))):
+        report[f"{key}_p50_seconds"] = _percentile(values, 0.5)
+        report[f"{key}_p95_seconds"] = _percentile(values, 0.95)
+    for key in ("tool_seconds", "step_seconds"):
+        names = {name for s in summaries for name in s[key]}
+        report[key] = {
+            name: {"p50": _percentile([v for s in summaries for v in s[key].get(name, [])], 0.5),
+                   "p95": _percentile([v for s in summaries for v in s[key].get(name, [])], 0.95)}
+            for name in sorted(names)
+        }
+    return report
+
+
+def histogram(values: List[float], bins: int = 10, width: int = 40, unit: str = "s") -> str:
+    if not values:
+        return "(no data)"
+    low, high = min(values), max(values)
+    step = (high - low) / bins or 1.0
+    counts = [0] * bins
+    for value in values:
+        counts[min(int((value - low) / step), bins - 1)] += 1
+    peak = max(counts)
+    return "\n".join(
+        f"{low + i * step:10.4f}{unit} | {'#' * max(round(width * count / peak), 1 if count else 0)} {count}"
+        for i, count in enumerate(counts)
+    )
@@ -1,183 +1,272 @@
-from langchain.agents import initialize_agent, Tool, AgentType
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
-from langchain_core.tools import BaseTool
-from typing import List, Dict, Any
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama.llms import OllamaLLM
-
-# ! pip install -r requirements.txt
-
-template = """Question: {question}
-Answer: Let's think step by step."""
-
-prompt = ChatPromptTemplate.from_template(template)
-
-supervisor_model = OllamaLLM(model="deepseek-r1:8b")
-tutor_model = OllamaLLM(model="llama3.2:3b")
-
-test_chain = prompt | supervisor_model
-test_chain.invoke({"question": "What is LangChain?"})
-
-
-# Create a memory buffer for the tutor agent
-tutor_memory = ConversationBufferMemory(
-    memory_key="chat_history",
-    return_messages=True
-)
-
-tutor_feedback = ConversationBufferMemory(
-    memory_key="feedback",
-    return_messages=True
-)
-
-# Define the tutor agent's prompt
-tutor_prompt = PromptTemplate(
-    input_variables=["chat_history", "input"],
-    template="""You are an English language tutor. Your role is to:
-    1. Provide clear explanations of the lesson materials
-    2. Provide constructive feedback to the student after each response
-    3. Maintain an encouraging and supportive tone
-    4. Keep a list of the student's strengths and weaknesses and add this to the feedback memory
-    Lession Materials:
-    1. Grammar Basics
-    1.1 Identify the subject and predicate in the following sentence: 'The cat sat on the mat.'
-    Previous conversation:
-    {chat_history}
-    Student's input: {input}
-    Tutor's response:"""
-)
-
-# Create the tutor chain
-tutor_chain = LLMChain(
-    llm=tutor_model,
-    prompt=tutor_prompt,
-    memory=tutor_memory,
-    verbose=True
-)
-
-# Define the tutor tool
-class TutorTool(BaseTool):
-    name: str = "english_tutor"
-    description: str = "Use this tool to interact with the English tutor for teaching and feedback"
-
-    def _run(self, query: str) -> str:
-        return tutor_chain.run(input=query)
-
-    def _arun(self, query: str) -> str:
-        raise NotImplementedError("Async not implemented")
-
-#Define the tutor tools
-
-class IntroduceLessonTool(BaseTool):
-    name: str = "introduce_lesson"
-    description: str = "Introduce the lesson material"
-
-    def _run(self, lesson_introduction: str) -> str:
-        introduction = f"Today's lesson is about: {lesson_introduction}"
-        print(introduction)
-        return introduction
-
-    def _arun(self, lesson_introduction: str) -> str:
-        raise NotImplementedError("Async not implemented")
-
-class ReadExerciseTool(BaseTool):
-    name: str = "read_exercise"
-    description: str = "Read out the first exercise and await a response"
-
-    def _run(self, exercise: str) -> str:
-        print(f"Exercise: {exercise}")
-        return exercise
-
-    def _arun(self, exercise: str) -> str:
-        raise NotImplementedError("Async not implemented")
-
-class GiveFeedbackTool(BaseTool):
-    name: str = "give_feedback"
-    description: str = "Give feedback on the response and proceed to the next exercise"
-
-    def _run(self, student_response: str) -> str:
-        feedback = tutor_chain.run(input=student_response)
-        print(f"Feedback: {feedback}")
-        return feedback
-
-    def _arun(self, student_response: str) -> str:
-        raise NotImplementedError("Async not implemented")
-
-class UpdateFeedbackMemoryTool(BaseTool):
-    name: str = "update_feedback_memory"
-    description: str = "Update the tutor_feedback memory buffer"
-
-    def _run(self, feedback: str) -> str:
-        tutor_feedback.add_message(feedback)
-        print("Feedback memory updated.")
-        return "Feedback memory updated."
-
-    def _arun(self, feedback: str) -> str:
-        raise NotImplementedError("Async not implemented")
-
-# Create tools list for supervisor agent
-tools = [
-    TutorTool(),
-    IntroduceLessonTool(),
-    ReadExerciseTool(),
-    GiveFeedbackTool(),
-    UpdateFeedbackMemoryTool(),
-]
-
-# Example usage
-# deploy_tool = DeployTutorTool()
-# deploy_tool._run("")
-
-# introduce_tool = IntroduceLessonTool()
-# introduce_tool._run("Grammar Basics")
-
-# read_tool = ReadExerciseTool()
-# read_tool._run("Identify the subject and predicate in the following sentence: 'The cat sat on the mat.'")
-
-# student_response = "The subject is 'The cat' and the predicate is 'sat on the mat.'"
-# feedback_tool = GiveFeedbackTool()
-# feedback = feedback_tool._run(student_response)
-
-# update_tool = UpdateFeedbackMemoryTool()
-# update_tool._run(feedback)
-
-
-# Create supervisor agent memory
-supervisor_memory = ConversationBufferMemory(
-    memory_key="chat_history",
-    return_messages=True
-)
-
-# Initialize the supervisor agent
-supervisor_agent = initialize_agent(
-    tools,
-    supervisor_model,
-    agent=AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
-    memory=supervisor_memory,
-    verbose=True
-)
-
-# Define the supervisor's system prompt
-supervisor_system_prompt = """You are a supervisor agent responsible for managing an English tutoring session. Your role is to:
-1. Assess the student's needs and current English level based on tutor_feedback memory.
-2. Deploy the English tutor agent to teach the lesson materials.
-3. Provide high-level guidance and structure to the session.
-4. Once the lesson is complete, review the feedback memory and plan the next lesson accordingly.
-Use the english_tutor tool to delegate actual teaching tasks and student interaction.
-Always maintain a clear structure and learning objectives for the session."""
-### Run the session
-# Function to run a tutoring session
-def run_tutoring_session(user_input: str) -> str:
-    response = supervisor_agent.run(
-        input=f"{supervisor_system_prompt}\n\nStudent input: {user_input}"
-    )
-    return response
-
-# Example usage
-if __name__ == "__main__":
-    # Example interaction
-    student_input = "Hi, I'm an intermediate English learner and I need help with phrasal verbs."
-    response = run_tutoring_session(student_input)
+import asyncio
+import logging
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
+from Model_Registry import lazy_import, registry, startup_report, timed
+
+with timed("import langchain_core"):
+    from langchain_core.tools import BaseTool
+    from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+
+with timed("import Agent_Utils"):
+    from Agent_Utils import BoundedOllamaLLM
+    from Lesson_Orchestrator import LessonContext, default_lesson
+
+# The langchain package (chains, memory, agents) is imported when the first
+# session is built
+if TYPE_CHECKING:
+    from langchain.chains import LLMChain
+    from Feedback_Cache import FeedbackCache
+    from Learner_Profile import LearnerProfileStore
+    from Memory_Utils import TokenBudgetMemory
+
+logger = logging.getLogger(__name__)
+
+# ! pip install -r requirements.txt
+
+template = """Question: {question}
+Answer: Let's think step by step."""
+
+prompt = ChatPromptTemplate.from_template(template)
+
+# Models are built on first use. Call registry.warm_up() to load them into
+# Ollama ahead of the first student turn. The supervisor tag lets the
+# streaming path tell its tokens apart from the tutor's.
+registry.register("supervisor_model", lambda: BoundedOllamaLLM(model="deepseek-r1:8b", tags=["supervisor"]))
+registry.register("tutor_model", lambda: BoundedOllamaLLM(model="llama3.2:3b"))
+# Feedback is answered by the tutor model first and escalated to the
+# supervisor model only for open-ended or low-confidence items
+registry.register("feedback_router", lambda: lazy_import("Model_Router").CascadeRouter(
+    small=registry.get("tutor_model"), large=registry.get("supervisor_model")
+))
+
+
+def __getattr__(name: str) -> Any:
+    # app.supervisor_model, app.tutor_model and app.test_chain resolve lazily
+    if name in ("supervisor_model", "tutor_model"):
+        return registry.get(name)
+    if name == "test_chain":
+        return prompt | registry.get("supervisor_model")
+    raise AttributeError(f"module 'app' has no attribute '{name}'")
+
+
+def smoke_test() -> str:
+    # One round trip to the supervisor model; no longer run at import time
+    return (prompt | registry.get("supervisor_model")).invoke({"question": "What is LangChain?"})
+
+
+# Define the tutor agent's prompt
+tutor_prompt = PromptTemplate(
+    input_variables=["chat_history", "lesson_material", "input"],
+    template="""You are an English language tutor. Your role is to:
+    1. Provide clear explanations of the lesson materials
+    2. Provide constructive feedback to the student after each response
+    3. Maintain an encouraging and supportive tone
+    4. Keep a list of the student's strengths and weaknesses and add this to their learner profile
+    Lesson Materials:
+    {lesson_material}
+    Previous conversation:
+    {chat_history}
+    Student's input: {input}
+    Tutor's response:"""
+)
+
+# Memories are built per session so concurrent students never share state.
+# Conversation memories keep a fixed token budget: recent turns verbatim and
+# older ones folded into a running summary by the tutor model.
+def build_tutor_memory() -> "TokenBudgetMemory":
+    TokenBudgetMemory = lazy_import("Memory_Utils").TokenBudgetMemory
+    return TokenBudgetMemory(
+        llm=registry.get("tutor_model"),
+        memory_key="chat_history",
+        input_key="input",
+        return_messages=True
+    )
+
+def build_supervisor_memory() -> "TokenBudgetMemory":
+    TokenBudgetMemory = lazy_import("Memory_Utils").TokenBudgetMemory
+    return TokenBudgetMemory(
+        llm=registry.get("tutor_model"),
+        memory_key="chat_history",
+        return_messages=True
+    )
+
+# Create the tutor chain
+def build_tutor_chain(memory: "TokenBudgetMemory") -> "LLMChain":
+    LLMChain = lazy_import("langchain.chains").LLMChain
+    return LLMChain(
+        llm=registry.get("tutor_model"),
+        prompt=tutor_prompt,
+        memory=memory,
+        verbose=logger.isEnabledFor(logging.DEBUG)
+    )
+
+# Define the tutor tool
+class TutorTool(BaseTool):
+    name: str = "english_tutor"
+    description: str = "Use this tool to interact with the English tutor for teaching and feedback"
+    tutor_chain: Any = None
+    lesson_context: Any = None
+
+    def _run(self, query: str) -> str:
+        return self.tutor_chain.run(input=query, lesson_material=self.lesson_context.material(query))
+
+    async def _arun(self, query: str) -> str:
+        return await self.tutor_chain.arun(input=query, lesson_material=self.lesson_context.material(query))
+
+#Define the tutor tools
+
+class IntroduceLessonTool(BaseTool):
+    name: str = "introduce_lesson"
+    description: str = "Introduce the lesson material"
+
+    def _run(self, lesson_introduction: str) -> str:
+        introduction = f"Today's lesson is about: {lesson_introduction}"
+        logger.debug(introduction)
+        return introduction
+
+    async def _arun(self, lesson_introduction: str) -> str:
+        return self._run(lesson_introduction)
+
+class ReadExerciseTool(BaseTool):
+    name: str = "read_exercise"
+    description: str = "Read out the first exercise and await a response"
+
+    def _run(self, exercise: str) -> str:
+        logger.debug("Exercise: %s", exercise)
+        return exercise
+
+    async def _arun(self, exercise: str) -> str:
+        return self._run(exercise)
+
+class GiveFeedbackTool(BaseTool):
+    name: str = "give_feedback"
+    description: str = "Give feedback on the response and proceed to the next exercise"
+    tutor_chain: Any = None
+    lesson_context: Any = None
+    feedback_cache: Any = None
+
+    def _cached(self, student_response: str) -> Optional[str]:
+        if self.feedback_cache is None:
+            return None
+        # Keyed like FeedbackTools, so both share entries and a changed answer key invalidates them
+        feedback = self.feedback_cache.get(*self.lesson_context.exercise_fields(), student_response)
+        if feedback is not None:
+            # Keep the session transcript coherent even though the model was skipped
+            self.tutor_chain.memory.save_context({"input": student_response}, {"text": feedback})
+        return feedback
+
+    def _store(self, student_response: str, feedback: str) -> None:
+        if self.feedback_cache is not None:
+            self.feedback_cache.put(*self.lesson_context.exercise_fields(), student_response, feedback)
+
+    def _run(self, student_response: str) -> str:
+        feedback = self._cached(student_response)
+        if feedback is None:
+            feedback = self.tutor_chain.run(
+                input=student_response, lesson_material=self.lesson_context.material(student_response)
+            )
+            self._store(student_response, feedback)
+        logger.debug("Feedback: %s", feedback)
+        return feedback
+
+    async def _arun(self, student_response: str) -> str:
+        # The cache does blocking SQLite I/O, so it runs off the event loop
+        feedback = await asyncio.to_thread(self._cached, student_response)
+        if feedback is None:
+            feedback = await self.tutor_chain.arun(
+                input=student_response, lesson_material=self.lesson_context.material(student_response)
+            )
+            await asyncio.to_thread(self._store, student_response, feedback)
+        logger.debug("Feedback: %s", feedback)
+        return feedback
+
+class UpdateFeedbackMemoryTool(BaseTool):
+    name: str = "update_feedback_memory"
+    description: str = "Record a short note on the student's strengths or weaknesses in their learner profile"
+    learner_profiles: Any = None
+    student_id: str = "default"
+
+    def record(self, skill: str, score: Optional[float], error_tags: Optional[List[str]] = None) -> None:
+        # Structured update, used when the answer's grade is already known
+        self.learner_profiles.record(self.student_id, skill, score, error_tags or ())
+
+    def digest(self) -> str:
+        return self.learner_profiles.digest(self.student_id)
+
+    def _run(self, feedback: str) -> str:
+        # The agent passes free text, which is no grade: mastery is only moved
+        # by graded answers, and the note is kept as written in its own list
+        self.learner_profiles.record_note(self.student_id, feedback)
+        logger.debug("Learner profile updated: %s", feedback)
+        return "Learner profile updated."
+
+    async def _arun(self, feedback: str) -> str:
+        # In-memory update; the store writes to disk in the background
+        return self._run(feedback)
+
+# Create tools list for supervisor agent
+def build_tools(tutor_chain: "LLMChain", learner_profiles: "LearnerProfileStore", student_id: str = "default",
+                feedback_cache: Optional["FeedbackCache"] = None,
+                lesson_context: Optional[LessonContext] = None) -> List[BaseTool]:
+    # The tutor only sees the current exercise and the most relevant notes
+    lesson_context = lesson_context or LessonContext(default_lesson)
+    return [
+        TutorTool(tutor_chain=tutor_chain, lesson_context=lesson_context),
+        IntroduceLessonTool(),
+        ReadExerciseTool(),
+        GiveFeedbackTool(tutor_chain=tutor_chain, lesson_context=lesson_context, feedback_cache=feedback_cache),
+        UpdateFeedbackMemoryTool(learner_profiles=learner_profiles, student_id=student_id),
+    ]
+
+# Example usage
+# deploy_tool = DeployTutorTool()
+# deploy_tool._run("")
+
+# introduce_tool = IntroduceLessonTool()
+# introduce_tool._run("Grammar Basics")
+
+# read_tool = ReadExerciseTool()
+# read_tool._run("Identify the subject and predicate in the following sentence: 'The cat sat on the mat.'")
+
+# student_response = "The subject is 'The cat' and the predicate is 'sat on the mat.'"
+# feedback_tool = GiveFeedbackTool()
+# feedback = feedback_tool._run(student_response)
+
+# update_tool = UpdateFeedbackMemoryTool()
+# update_tool._run(feedback)
+
+
+# Initialize the supervisor agent
+def build_supervisor_agent(tools: List[BaseTool], memory: "TokenBudgetMemory"):
+    agents = lazy_import("langchain.agents")
+    return agents.initialize_agent(
+        tools,
+        registry.get("supervisor_model"),
+        agent=agents.AgentType.CONVERSATIONAL_REACT_DESCRIPTION,
+        memory=memory,
+        verbose=logger.isEnabledFor(logging.DEBUG)
+    )
+
+# Define the supervisor's system prompt
+supervisor_system_prompt = """You are a supervisor agent responsible for managing an English tutoring session. Your role is to:
+1. Assess the student's needs and current English level based on their learner profile.
+2. Deploy the English tutor agent to teach the lesson materials.
+3. Provide high-level guidance and structure to the session.
+4. Once the lesson is complete, review the learner profile and plan the next lesson accordingly.
+Use the english_tutor tool to delegate actual teaching tasks and student interaction.
+Always maintain a clear structure and learning objectives for the session."""
+### Run the session
+# Function to run a tutoring session. Sessions are isolated by session_id;
+# see Session_Manager.SessionManager for the concurrent, async entry point.
+def run_tutoring_session(user_input: str, session_id: str = "default") -> str:
+    from Session_Manager import default_session_manager
+    return asyncio.run(default_session_manager.run_tutoring_session(session_id, user_input))
+
+# Example usage
+if __name__ == "__main__":
+    registry.warm_up()
+    print(startup_report())
+    # Example interaction
+    student_input = "Hi, I'm an intermediate English learner and I need help with phrasal verbs."
+    response = run_tutoring_session(student_input)
     print(response)
\ No newline at end of file
@@ -1,12 +1,17 @@
-import gradio as gr
-
-def greet(name):
-    return f"Hello, {name}!"
-
-iface = gr.Interface(fn=greet, inputs="text", 
-                     outputs="text", 
-                     title="Greeting App", 
-                     description="Enter your name to get a greeting")
-
-if __name__ == "__main__":
-    iface.launch()
\ No newline at end of file
+import gradio as gr
+
+from Session_Manager import default_session_manager
+
+async def respond(message, history, request: gr.Request):
+    # One tutoring session per browser tab; tokens are rendered as they arrive
+    response = ""
+    async for token in default_session_manager.astream_tutoring_session(request.session_hash, message):
+        response += token
+        yield response
+
+iface = gr.ChatInterface(fn=respond,
+                         title="English Tutor",
+                         description="Chat with your English tutor")
+
+if __name__ == "__main__":
+    iface.launch()